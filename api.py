@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import hmac
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import pandas as pd
+
+import database
+
+# Headless JSON API for OPAC kiosks and self-checkout stations
+# A small HTTP/1.1 server on asyncio streams with keep-alive. Every SQLite call
+# runs on a fixed thread pool no larger than the connection pool, and a
+# semaphore caps how many requests are inside the data layer at once; excess
+# requests wait, and are turned away with 503 once the wait queue is full.
+# Reads go through the same query cache as the Streamlit app, and writes made
+# by either process invalidate it through PRAGMA data_version.
+HOST = os.environ.get('LIBRARY_API_HOST', '127.0.0.1')
+PORT = int(os.environ.get('LIBRARY_API_PORT', '8502'))
+WORKERS = int(os.environ.get('LIBRARY_API_WORKERS', str(database.POOL_SIZE)))
+MAX_CONCURRENCY = int(os.environ.get('LIBRARY_API_CONCURRENCY', str(WORKERS * 4)))
+MAX_PENDING = int(os.environ.get('LIBRARY_API_MAX_PENDING', '1000'))
+# Borrow, return and patron loan history need "Authorization: Bearer <token>"
+# when this is set
+API_TOKEN = os.environ.get('LIBRARY_API_TOKEN')
+
+LOAN_PERIOD_DAYS = 14
+MAX_LOAN_DAYS = 365
+MAX_BODY_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+KEEPALIVE_TIMEOUT = 15
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+               405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+               500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def records(df):
+    # DataFrame rows as plain dicts with missing values as null and dates as
+    # ISO strings
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime('%Y-%m-%d')
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+# Handlers
+# Each handler runs on a worker thread and returns (status, payload)
+def handle_health(params, body):
+    return 200, {'status': 'ok', 'schema_version': database.SCHEMA_VERSION}
+
+def handle_search(params, body):
+    query = params.get('q', '').strip()
+    field = params.get('field', 'All Fields')
+    if field not in database.SEARCH_FIELDS:
+        raise ApiError(400, f"field must be one of: {', '.join(database.SEARCH_FIELDS)}")
+    try:
+        limit = min(max(int(params.get('limit', database.SEARCH_LIMIT)), 1), database.SEARCH_LIMIT)
+    except ValueError:
+        raise ApiError(400, "limit must be an integer")
+    if not query:
+        return 200, {'results': []}
+    return 200, {'results': records(database.search_books(query, field, limit))}
+
+def handle_book(params, body, book_id):
+    book = database.get_book(book_id)
+    if book is None:
+        raise ApiError(404, f"Book {book_id} does not exist.")
+    return 200, book
+
+def handle_patron_loans(params, body, borrower_id):
+    open_only = params.get('all', '0').lower() not in ('1', 'true', 'yes')
+    include_archive = params.get('archive', '0').lower() in ('1', 'true', 'yes')
+    return 200, {'borrower_id': borrower_id,
+                 'loans': records(database.get_loans_by_borrower(borrower_id, open_only, include_archive))}
+
+def require_fields(body, *names):
+    missing = [name for name in names if not str(body.get(name) or '').strip()]
+    if missing:
+        raise ApiError(400, f"Missing field(s): {', '.join(missing)}")
+    return [str(body[name]).strip() for name in names]
+
+def handle_borrow(params, body):
+    book_id, borrower_id = require_fields(body, 'book_id', 'borrower_id')
+    borrower_name = str(body.get('borrower_name') or '').strip() or database.get_user_full_name(borrower_id)
+    if not borrower_name:
+        raise ApiError(400, f"Unknown borrower {borrower_id}; send borrower_name.")
+    try:
+        days = int(body.get('days', LOAN_PERIOD_DAYS))
+    except (TypeError, ValueError):
+        raise ApiError(400, "days must be an integer")
+    if not 1 <= days <= MAX_LOAN_DAYS:
+        raise ApiError(400, f"days must be between 1 and {MAX_LOAN_DAYS}")
+    borrow_date = date.today()
+    due_date = borrow_date + timedelta(days=days)
+    database.borrow_book(book_id, borrower_name, borrower_id, borrow_date, due_date)
+    return 201, {'book_id': book_id, 'borrower_id': borrower_id, 'borrower_name': borrower_name,
+                 'borrow_date': borrow_date.isoformat(), 'due_date': due_date.isoformat()}
+
+def handle_return(params, body):
+    book_id, borrower_id = require_fields(body, 'book_id', 'borrower_id')
+    database.return_book(book_id, borrower_id)
+    return 200, {'book_id': book_id, 'borrower_id': borrower_id, 'status': 'Returned'}
+
+# (method, path prefix, path suffix, handler, needs the API token). Routes
+# with a suffix take the path segment between prefix and suffix as argument.
+ROUTES = [
+    ('GET', '/health', None, handle_health, False),
+    ('GET', '/books/search', None, handle_search, False),
+    ('GET', '/books/', '', handle_book, False),
+    ('GET', '/patrons/', '/loans', handle_patron_loans, True),
+    ('POST', '/loans', None, handle_borrow, True),
+    ('POST', '/returns', None, handle_return, True),
+]
+
+def resolve(method, path):
+    # Returns (handler, args, needs_token) for the request path
+    allowed = False
+    for route_method, prefix, suffix, handler, needs_token in ROUTES:
+        if suffix is None:
+            if path != prefix:
+                continue
+            args = ()
+        else:
+            if not (path.startswith(prefix) and path.endswith(suffix)):
+                continue
+            arg = unquote(path[len(prefix):len(path) - len(suffix)])
+            if not arg or '/' in arg:
+                continue
+            args = (arg,)
+        if route_method != method:
+            allowed = True
+            continue
+        return handler, args, needs_token
+    raise ApiError(405 if allowed else 404, "Method not allowed" if allowed else "Not found")
+
+
+# Server
+class LibraryApi:
+    def __init__(self, workers=WORKERS, max_concurrency=MAX_CONCURRENCY, max_pending=MAX_PENDING, token=API_TOKEN):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library-api')
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.token = token
+        self.active = 0
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        handler, args, needs_token = resolve(method, url.path.rstrip('/') or '/')
+        if needs_token and self.token:
+            supplied = headers.get('authorization', '')
+            if not hmac.compare_digest(supplied.encode(), f"Bearer {self.token}".encode()):
+                raise ApiError(401, "Missing or invalid API token")
+        if method == 'POST':
+            try:
+                body = json.loads(body or b'{}')
+            except ValueError:
+                raise ApiError(400, "Request body must be JSON")
+            if not isinstance(body, dict):
+                raise ApiError(400, "Request body must be a JSON object")
+
+        if self.active >= self.max_concurrency + self.max_pending:
+            raise ApiError(503, "Server is busy, please try again.")
+        self.active += 1
+        try:
+            async with self.semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, lambda: handler(params, body, *args))
+        finally:
+            self.active -= 1
+
+    async def respond(self, method, target, headers, body):
+        try:
+            status, payload = await self.dispatch(method, target, headers, body)
+        except ApiError as e:
+            status, payload = e.status, {'error': str(e)}
+        except database.CirculationError as e:
+            status = 503 if 'busy' in str(e) else 409
+            payload = {'error': str(e)}
+        except Exception as e:
+            print(f"library-api: {method} {target} failed: {e!r}", file=sys.stderr)
+            status, payload = 500, {'error': "Internal server error"}
+        return status, json.dumps(payload, default=str).encode()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.write(writer, 413, b'{"error": "Headers too large"}', False)
+                    return
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                except ValueError:
+                    await self.write(writer, 400, b'{"error": "Malformed request line"}', False)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                try:
+                    length = int(headers.get('content-length', '0'))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > MAX_BODY_BYTES:
+                    await self.write(writer, 413, b'{"error": "Request body too large"}', False)
+                    return
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self.respond(method.upper(), target, headers, body)
+                await self.write(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def write(self, writer, status, payload, keep_alive):
+        writer.write((f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Unknown')}\r\n"
+                      f"Content-Type: application/json\r\n"
+                      f"Content-Length: {len(payload)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + payload)
+        await writer.drain()
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES,
+                                            backlog=1024)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SAD Library System JSON API")
+    parser.add_argument('--db', help="path to the SQLite database (default: library.db)")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS, help="threads running SQLite work")
+    parser.add_argument('--max-concurrency', type=int, default=MAX_CONCURRENCY,
+                        help="requests allowed inside the data layer at once")
+    args = parser.parse_args(argv)
+
+    # Each worker thread keeps its own pooled connection
+    database.configure(path=args.db, pool_size=max(args.workers, database.POOL_SIZE))
+    database.init_db()
+    if database.REPLICA_ENABLED:
+        database.start_replica()
+
+    async def run():
+        api = LibraryApi(args.workers, args.max_concurrency)
+        try:
+            await api.serve(args.host, args.port, ready=lambda server: print(
+                f"Library API listening on http://{args.host}:{args.port}", file=sys.stderr, flush=True))
+        finally:
+            api.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import io
+import os
+import re
+import base64
+import hashlib
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Static asset pipeline
+# Images are optimized once per process and written to static/_build under a
+# content-hashed name, then referenced through Streamlit's static file serving
+# (server.enableStaticServing). The browser downloads and caches the file once
+# instead of receiving it inline as base64 on every rerun, and a changed image
+# always gets a new URL.
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, 'static')
+BUILD_DIR = os.path.join(STATIC_DIR, '_build')
+STATIC_URL = 'app/static'
+
+BACKGROUND_IMAGE = 'LIBRARY ROOM.jpg'
+BACKGROUND_MAX_WIDTH = 1920
+BACKGROUND_QUALITY = 80
+
+_built = {}
+_lock = threading.Lock()
+
+
+def optimize_jpeg(data, max_width, quality):
+    # Downscales and recompresses with Pillow when it is installed; the
+    # original bytes are kept if Pillow is missing or the result is not smaller
+    if Image is None:
+        return data
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.width > max_width:
+        image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+    out = io.BytesIO()
+    image.convert('RGB').save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    optimized = out.getvalue()
+    return optimized if len(optimized) < len(data) else data
+
+def build_image(name, max_width, quality):
+    # Returns the build file name and bytes of the optimized image
+    with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+        data = optimize_jpeg(f.read(), max_width, quality)
+    stem = re.sub(r'[^a-z0-9]+', '-', os.path.splitext(name)[0].lower()).strip('-')
+    return f"{stem}-{hashlib.sha256(data).hexdigest()[:12]}.jpg", data
+
+def write_build(built_name, data):
+    built_path = os.path.join(BUILD_DIR, built_name)
+    if not os.path.exists(built_path):
+        os.makedirs(BUILD_DIR, exist_ok=True)
+        tmp_path = f"{built_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, built_path)
+
+def image_url(name, static_serving=True, max_width=BACKGROUND_MAX_WIDTH, quality=BACKGROUND_QUALITY):
+    # URL for an image under static/, or None if it cannot be read. Without
+    # static serving, or if static/_build cannot be written (a read-only app
+    # directory), it falls back to a data URI, still encoded only once.
+    key = (name, static_serving, max_width, quality)
+    with _lock:
+        if key not in _built:
+            try:
+                built_name, data = build_image(name, max_width, quality)
+            except OSError:
+                _built[key] = None
+            else:
+                url = None
+                if static_serving:
+                    try:
+                        write_build(built_name, data)
+                        url = f"{STATIC_URL}/_build/{built_name}"
+                    except OSError:
+                        pass
+                _built[key] = url or "data:image/jpeg;base64," + base64.b64encode(data).decode()
+        return _built[key]
+
+def background_image_url(static_serving=True):
+    return image_url(BACKGROUND_IMAGE, static_serving)
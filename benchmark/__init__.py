@@ -0,0 +1 @@
+# Synthetic-data benchmarks for the library data layer; run with `python -m benchmark`
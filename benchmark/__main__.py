@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+
+import database
+from benchmark import datagen, runner
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark',
+                                     description="Benchmark every data-access path on a synthetic library")
+    parser.add_argument('--size', choices=list(datagen.SIZES), default='small')
+    parser.add_argument('--books', type=int, help="override the preset's number of books")
+    parser.add_argument('--users', type=int, help="override the preset's number of students")
+    parser.add_argument('--loans', type=int, help="override the preset's number of loans")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help="scratch database path (default: a file in the temp dir)")
+    parser.add_argument('--reuse', action='store_true',
+                        help="reuse the scratch database if it was generated with the same sizes and seed")
+    parser.add_argument('--iterations', type=int, default=runner.DEFAULT_ITERATIONS)
+    parser.add_argument('--heavy-iterations', type=int, default=runner.HEAVY_ITERATIONS,
+                        help="iterations for benchmarks that load whole tables")
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--only', help="comma-separated benchmark names to run")
+    parser.add_argument('--skip', help="comma-separated benchmark names to leave out")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    sizes = dict(datagen.SIZES[args.size])
+    for key in ('books', 'users', 'loans'):
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    path = args.db or os.path.join(tempfile.gettempdir(),
+                                   f"library_bench_{sizes['books']}_{sizes['users']}_{sizes['loans']}.db")
+
+    meta = datagen.load_meta(path) if args.reuse and os.path.exists(path) else None
+    if meta and all(meta.get(k) == v for k, v in dict(sizes, seed=args.seed).items()):
+        log(f"Reusing {path}")
+        database.configure(path=path)
+        database.init_db()
+    else:
+        log(f"Generating {path}")
+        meta = datagen.generate(path, seed=args.seed, log=lambda m: log(f"  {m}"), **sizes)
+
+    results = runner.run_all(meta, args.iterations, args.heavy_iterations, args.threads,
+                             only=set(args.only.split(',')) if args.only else None,
+                             skip=set(args.skip.split(',')) if args.skip else None,
+                             log=log)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'size': args.size,
+            'dataset': meta,
+            'threads': args.threads,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        log(f"Results written to {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
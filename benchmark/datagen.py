@@ -0,0 +1,153 @@
+import os
+import json
+import random
+import time
+from datetime import date, timedelta
+
+import database
+
+# Synthetic library data for benchmarking
+# Books, students and loan history are generated deterministically from a seed
+# and bulk-loaded into a scratch database with derived indexes dropped, then
+# indexed, counted and ANALYZEd once at the end.
+SIZES = {
+    'small': {'books': 5000, 'users': 1000, 'loans': 10000},
+    'medium': {'books': 100000, 'users': 20000, 'loans': 1000000},
+    'large': {'books': 500000, 'users': 100000, 'loans': 10000000},
+}
+
+CATEGORIES = ['Programming', 'Data Science', 'Web Development', 'Database', 'Networking', 'Fiction', 'History', 'Other']
+CATEGORY_WEIGHTS = [25, 15, 15, 10, 10, 12, 8, 5]
+TITLE_WORDS = [
+    'Python', 'Data', 'Science', 'Web', 'Development', 'Guide', 'Handbook', 'Introduction', 'Advanced', 'Modern',
+    'Practical', 'Systems', 'Design', 'Networks', 'Database', 'Algorithms', 'Learning', 'Machine', 'Deep', 'Cloud',
+    'Security', 'Programming', 'Patterns', 'Architecture', 'Analysis', 'Statistics', 'History', 'World', 'Library',
+    'Ocean', 'Mountain', 'River', 'Garden', 'Night', 'Summer', 'Winter', 'Secret', 'Journey', 'Empire', 'Kingdom',
+    'Engineering', 'Computing', 'Foundations', 'Principles', 'Essentials', 'Complete', 'Reference', 'Cookbook',
+]
+FIRST_NAMES = ['John', 'Jane', 'Mike', 'Sarah', 'Ana', 'Luis', 'Maria', 'Chen', 'Wei', 'Aisha', 'Omar', 'Priya',
+               'Ravi', 'Sofia', 'Noah', 'Emma', 'Liam', 'Olivia', 'Kenji', 'Yuki', 'Carlos', 'Elena', 'Ivan', 'Nadia']
+LAST_NAMES = ['Smith', 'Doe', 'Johnson', 'Williams', 'Garcia', 'Santos', 'Reyes', 'Cruz', 'Wang', 'Li', 'Khan',
+              'Patel', 'Kumar', 'Rossi', 'Muller', 'Brown', 'Tanaka', 'Sato', 'Lopez', 'Petrov', 'Silva', 'Kim']
+
+BENCH_PASSWORD = 'student123'
+LOAN_PERIOD_DAYS = 14
+HISTORY_DAYS = 5 * 365
+OPEN_LOAN_RATE = 0.05
+CHUNK_SIZE = 50000
+
+
+def book_id(i):
+    return f"BK{i:07d}"
+
+def borrower_id(i):
+    return f"STU{i:06d}"
+
+def person_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def meta_path(path):
+    return path + '.meta.json'
+
+def load_meta(path):
+    try:
+        with open(meta_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _insert_chunks(conn, sql, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            conn.executemany(sql, chunk)
+            conn.commit()
+            chunk = []
+    if chunk:
+        conn.executemany(sql, chunk)
+        conn.commit()
+
+def generate(path, books, users, loans, seed=42, log=None):
+    # Builds a fresh scratch database at `path` and returns its metadata
+    log = log or (lambda message: None)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    database.configure(path=path)
+    database.init_db()
+
+    rng = random.Random(seed)
+    today = date.today()
+    started = time.perf_counter()
+
+    titles = [' '.join(rng.sample(TITLE_WORDS, rng.randint(2, 4))) for _ in range(books)]
+    quantities = [rng.randint(1, 8) for _ in range(books)]
+    open_counts = [0] * books
+
+    with database.get_connection() as conn:
+        conn.execute("PRAGMA synchronous=OFF")
+        database.drop_books_maintenance(conn)
+        database.drop_loan_indexes(conn)
+        conn.commit()
+
+        log(f"books: {books:,}")
+        _insert_chunks(conn, f"INSERT INTO books ({', '.join(database.BOOK_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+            (book_id(i), titles[i], person_name(rng), f"978-{rng.randrange(10 ** 10):010d}",
+             rng.choices(CATEGORIES, CATEGORY_WEIGHTS)[0], quantities[i], quantities[i], 'Available')
+            for i in range(books)))
+
+        log(f"users: {users:,}")
+        password = database.hash_password(BENCH_PASSWORD)
+        names = [person_name(rng) for _ in range(users)]
+        _insert_chunks(conn, "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", (
+            (borrower_id(i), password, names[i], f"{borrower_id(i).lower()}@library.com", 'Student',
+             (today - timedelta(days=rng.randrange(HISTORY_DAYS))).isoformat())
+            for i in range(users)))
+        _insert_chunks(conn, "INSERT INTO patrons (borrower_id, name, username) VALUES (?, ?, ?)", (
+            (borrower_id(i), names[i], borrower_id(i)) for i in range(users)))
+        book_keys = dict(conn.execute("SELECT book_id, id FROM books"))
+        book_keys = [book_keys[book_id(i)] for i in range(books)]
+        patron_keys = dict(conn.execute("SELECT borrower_id, id FROM patrons"))
+        patron_keys = [patron_keys[borrower_id(i)] for i in range(users)]
+
+        def loan_rows():
+            for _ in range(loans):
+                # Squaring the uniform draw skews demand towards popular titles
+                b = int(books * rng.random() ** 2)
+                u = rng.randrange(users)
+                is_open = rng.random() < OPEN_LOAN_RATE and open_counts[b] < quantities[b]
+                if is_open:
+                    # Borrowed within the last ~2.5 weeks, so about a fifth are overdue
+                    borrowed = today - timedelta(days=rng.randrange(LOAN_PERIOD_DAYS + 4))
+                    open_counts[b] += 1
+                else:
+                    borrowed = today - timedelta(days=rng.randrange(LOAN_PERIOD_DAYS, HISTORY_DAYS))
+                due = borrowed + timedelta(days=LOAN_PERIOD_DAYS)
+                # Returns land up to a week either side of the due date
+                returned = None if is_open else min(due + timedelta(days=rng.randint(-7, 7)), today)
+                yield (book_keys[b], patron_keys[u], borrowed.isoformat(), due.isoformat(),
+                       'Borrowed' if is_open else 'Returned', returned and returned.isoformat())
+
+        log(f"loans: {loans:,}")
+        _insert_chunks(conn, """INSERT INTO loans (book_id, patron_id, borrow_date, due_date, status, returned_date)
+                                VALUES (?, ?, ?, ?, ?, ?)""", loan_rows())
+
+        conn.executemany("UPDATE books SET available = ?, status = ? WHERE book_id = ?", [
+            (quantities[i] - n, 'Available' if quantities[i] > n else 'Out of Stock', book_id(i))
+            for i, n in enumerate(open_counts) if n])
+        conn.commit()
+
+        log("indexes, search index and counters")
+        database.ensure_loan_indexes(conn)
+        database.restore_books_maintenance(conn)
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+    meta = {'books': books, 'users': users, 'loans': loans, 'seed': seed,
+            'open_loans': sum(open_counts), 'generated_in_s': round(time.perf_counter() - started, 2)}
+    with open(meta_path(path), 'w') as f:
+        json.dump(meta, f)
+    return meta
@@ -0,0 +1,182 @@
+import time
+import random
+import threading
+from datetime import date, timedelta
+
+import database
+from metrics import percentile
+from benchmark import datagen
+
+# Headless timing of the data-access layer
+# Each benchmark is an operation `op(rng)` that performs one call. Cached read
+# helpers are timed through their `uncached` function so the numbers reflect
+# SQLite and pandas work, except where a benchmark measures the cache itself.
+DEFAULT_ITERATIONS = 200
+HEAVY_ITERATIONS = 5
+WARMUP = 3
+# Write benchmarks borrow as these patrons, never as generated students, and
+# everything they write is removed again after the run (see discard_writes)
+BENCH_BORROWER_PREFIX = 'BENCH'
+BENCH_BORROWERS = 100
+WRITE_BENCHMARKS = {'borrow_return'}
+
+
+def run_benchmark(name, op, iterations, threads=1, seed=0):
+    # Runs `op` `iterations` times split over `threads` threads and returns
+    # latency percentiles (ms) and throughput (ops/s)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    rng = random.Random(seed)
+    for _ in range(min(WARMUP, iterations)):
+        try:
+            op(rng)
+        except database.CirculationError:
+            pass
+
+    def worker(worker_id, count):
+        rng = random.Random(seed * 1000 + worker_id)
+        local = []
+        local_errors = 0
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                op(rng)
+            except database.CirculationError:
+                local_errors += 1
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+            errors.append(local_errors)
+
+    per_thread = [iterations // threads + (1 if i < iterations % threads else 0) for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_thread) if n]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'name': name,
+        'iterations': len(latencies),
+        'threads': threads,
+        'errors': sum(errors),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'min_ms': round(latencies[0], 3) if latencies else 0.0,
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'ops_per_sec': round(len(latencies) / wall, 1) if wall else 0.0,
+    }
+
+
+def benchmarks(meta):
+    # Returns (name, op, heavy) for every data-access path. Heavy benchmarks
+    # materialize whole tables and run with fewer iterations.
+    books, users = meta['books'], meta['users']
+    today = date.today()
+
+    def random_book(rng):
+        return datagen.book_id(rng.randrange(books))
+
+    def random_borrower(rng):
+        return datagen.borrower_id(rng.randrange(users))
+
+    def search_term(rng):
+        return rng.choice(datagen.TITLE_WORDS)[:rng.randint(3, 6)]
+
+    def login(rng):
+        database.verify_login(random_borrower(rng), datagen.BENCH_PASSWORD)
+
+    def borrow_return(rng):
+        book, borrower = random_book(rng), f"{BENCH_BORROWER_PREFIX}{rng.randrange(BENCH_BORROWERS):03d}"
+        database.borrow_book(book, 'Benchmark Borrower', borrower, today, today + timedelta(days=14))
+        database.return_book(book, borrower)
+
+    def dashboard_counters(rng):
+        database.get_catalog_stats.uncached()
+        database.get_category_counts.uncached()
+
+    def dashboard_recount(rng):
+        with database.get_connection() as conn:
+            database.compute_catalog_stats(conn)
+
+    def dashboard_circulation(rng):
+        database._get_daily_circulation.uncached((today - timedelta(days=database.CIRCULATION_DAYS - 1)).isoformat())
+        database.get_monthly_circulation.uncached()
+        database.get_most_borrowed.uncached()
+        database.get_category_demand.uncached()
+
+    def circulation_recount(rng):
+        with database.get_connection() as conn:
+            database.compute_circulation_stats(conn)
+
+    return [
+        ('login', login, False),
+        ('get_all_books', lambda rng: database.get_all_books.uncached(), True),
+        ('get_borrowed_books', lambda rng: database.get_borrowed_books.uncached(), True),
+        ('search_books', lambda rng: database.search_books.uncached(search_term(rng), 'All Fields'), False),
+        ('search_books_book_id', lambda rng: database.search_books.uncached(random_book(rng)[:6], 'Book ID'), False),
+        ('get_books_page', lambda rng: database.get_books_page.uncached(
+            None, (search_term(rng), ''), 25, 'title'), False),
+        ('get_books_page_cached', lambda rng: database.get_books_page(None, None, 25, 'title'), False),
+        ('dashboard_counters', dashboard_counters, False),
+        ('dashboard_recount', dashboard_recount, True),
+        ('dashboard_circulation', dashboard_circulation, False),
+        ('circulation_recount', circulation_recount, True),
+        ('get_open_loans', lambda rng: database.get_open_loans.uncached(), True),
+        ('get_overdue_loans', lambda rng: database._get_overdue_loans.uncached(today.isoformat()), True),
+        ('get_loans_by_borrower', lambda rng: database.get_loans_by_borrower.uncached(random_borrower(rng), False), False),
+        ('find_books', lambda rng: database.find_books.uncached(
+            rng.choice([random_book(rng)[:rng.randint(3, 7)], search_term(rng)]), available_only=True), False),
+        ('find_open_borrowers', lambda rng: database.find_open_borrowers.uncached(random_borrower(rng)[:rng.randint(3, 7)]), False),
+        ('borrow_return', borrow_return, False),
+    ]
+
+def loan_sequence():
+    with database.get_connection() as conn:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'loans'").fetchone()
+    return row[0] if row else None
+
+def discard_writes(seq):
+    # Puts the scratch database back the way the write benchmarks found it,
+    # so a --reuse run measures the same data: their loans and patrons are
+    # deleted, the loan id sequence is reset to `seq`, and the circulation
+    # rollups the deleted loans had moved are recounted. Borrows and returns
+    # cancel out in the books table and the Dashboard counters.
+    def op(conn):
+        conn.execute("""DELETE FROM loans WHERE patron_id IN
+                        (SELECT id FROM patrons WHERE borrower_id LIKE ?)""", (BENCH_BORROWER_PREFIX + '%',))
+        conn.execute("DELETE FROM patrons WHERE borrower_id LIKE ?", (BENCH_BORROWER_PREFIX + '%',))
+        if seq is None:
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'loans'")
+        else:
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'loans'", (seq,))
+    database.run_write(op)
+    database.rebuild_circulation_stats()
+
+def run_all(meta, iterations=DEFAULT_ITERATIONS, heavy_iterations=HEAVY_ITERATIONS, threads=1,
+            only=None, skip=None, log=None):
+    log = log or (lambda message: None)
+    results = []
+    seq = loan_sequence()
+    wrote = False
+    try:
+        for seed, (name, op, heavy) in enumerate(benchmarks(meta)):
+            if (only and name not in only) or (skip and name in skip):
+                continue
+            wrote = wrote or name in WRITE_BENCHMARKS
+            result = run_benchmark(name, op, heavy_iterations if heavy else iterations, threads, seed)
+            log(f"{name:24} p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+                f"p99 {result['p99_ms']:9.3f} ms  {result['ops_per_sec']:9.1f} ops/s")
+            results.append(result)
+    finally:
+        if wrote:
+            log("Discarding benchmark loans")
+            discard_writes(seq)
+    return results
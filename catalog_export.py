@@ -0,0 +1,144 @@
+import os
+import csv
+import time
+import tempfile
+
+import database
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Streaming exports
+# Rows are read from SQLite with fetchmany and written chunk by chunk to a
+# temporary file, so an export never materializes the whole table as a
+# DataFrame or as one big CSV string.
+CHUNK_SIZE = 5000
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'library_exports')
+EXPORT_MAX_AGE = 3600
+PARQUET_AVAILABLE = pa is not None
+FORMATS = ['csv', 'parquet'] if PARQUET_AVAILABLE else ['csv']
+
+BOOK_EXPORT_COLUMNS = [('book_id', 'string'), ('title', 'string'), ('author', 'string'), ('isbn', 'string'),
+                       ('category', 'string'), ('quantity', 'int64'), ('available', 'int64'), ('status', 'string')]
+LOAN_EXPORT_COLUMNS = [('id', 'int64'), ('book_id', 'string'), ('title', 'string'), ('borrower_name', 'string'),
+                       ('borrower_id', 'string'), ('borrow_date', 'date'), ('due_date', 'date'), ('status', 'string'),
+                       ('returned_date', 'date')]
+
+
+def books_query(category=None, available_only=False):
+    where, params = [], []
+    if category:
+        where.append("category = ?")
+        params.append(category)
+    if available_only:
+        where.append("available > 0")
+    sql = f"SELECT {', '.join(name for name, _ in BOOK_EXPORT_COLUMNS)} FROM books"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " ORDER BY book_id", params
+
+def loans_query(status=None, borrowed_from=None, borrowed_to=None, include_archive=False):
+    where, params = [], []
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if borrowed_from:
+        where.append("borrow_date >= ?")
+        params.append(borrowed_from.isoformat())
+    if borrowed_to:
+        where.append("borrow_date <= ?")
+        params.append(borrowed_to.isoformat())
+    table = 'loan_history' if include_archive else 'borrowed_books'
+    sql = f"SELECT {', '.join(name for name, _ in LOAN_EXPORT_COLUMNS)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " ORDER BY id", params
+
+
+def _write_csv(path, columns, chunks):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for rows in chunks:
+            writer.writerows(rows)
+
+def _arrow_column(values, kind):
+    if kind == 'int64':
+        return pa.array(values, type=pa.int64())
+    array = pa.array(values, type=pa.string())
+    if kind == 'date':
+        # Unparseable dates become nulls rather than failing the whole export
+        return pc.strptime(array, format='%Y-%m-%d', unit='s', error_is_null=True).cast(pa.date32())
+    return array
+
+def _write_parquet(path, columns, chunks):
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Parquet export needs the pyarrow package")
+    schema = pa.schema([(name, pa.date32() if kind == 'date' else getattr(pa, kind)()) for name, kind in columns])
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for rows in chunks:
+            values = list(zip(*rows))
+            writer.write_batch(pa.record_batch(
+                [_arrow_column(list(col), kind) for col, (_, kind) in zip(values, columns)], schema=schema))
+
+
+def cleanup_exports(max_age=EXPORT_MAX_AGE):
+    # Removes export files left behind by earlier sessions
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def export_query(sql, params, columns, fmt='csv', path=None, chunk_size=CHUNK_SIZE, prefix='export'):
+    # Writes the query result to `path` (a new temp file by default) and
+    # returns the path and the number of rows written
+    if fmt not in ('csv', 'parquet'):
+        raise ValueError(f"Unknown export format: {fmt}")
+    if path is None:
+        cleanup_exports()
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"{prefix}_", suffix=f".{fmt}", dir=EXPORT_DIR)
+        os.close(fd)
+
+    row_count = 0
+    with database.get_connection() as conn:
+        # One read transaction, so the export is a consistent snapshot
+        conn.execute("BEGIN")
+        try:
+            cursor = conn.execute(sql, params)
+
+            def chunks():
+                nonlocal row_count
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        return
+                    row_count += len(rows)
+                    yield rows
+
+            if fmt == 'csv':
+                _write_csv(path, columns, chunks())
+            else:
+                _write_parquet(path, columns, chunks())
+        finally:
+            conn.rollback()
+    return path, row_count
+
+def export_books(fmt='csv', path=None, category=None, available_only=False, chunk_size=CHUNK_SIZE):
+    sql, params = books_query(category, available_only)
+    return export_query(sql, params, BOOK_EXPORT_COLUMNS, fmt, path, chunk_size, prefix='library_inventory')
+
+def export_loans(fmt='csv', path=None, status=None, borrowed_from=None, borrowed_to=None,
+                 include_archive=False, chunk_size=CHUNK_SIZE):
+    sql, params = loans_query(status, borrowed_from, borrowed_to, include_archive)
+    return export_query(sql, params, LOAN_EXPORT_COLUMNS, fmt, path, chunk_size, prefix='loan_history')
@@ -0,0 +1,223 @@
+import io
+import os
+import csv
+import json
+import time
+
+import database
+
+# Bulk catalog import
+# Rows are streamed from a CSV or JSON Lines file, validated, and written with
+# executemany in transactions of `batch_size` rows, so memory use is bounded by
+# one batch no matter how large the file is.
+BATCH_SIZE = 10000
+MAX_ERRORS = 20
+DUPLICATE_MODES = ['skip', 'upsert']
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl'}
+
+INSERT_SQL = {
+    'skip': '''INSERT INTO books (book_id, title, author, isbn, category, quantity, available, status)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (book_id) DO NOTHING''',
+    # Copies already on loan (quantity - available) stay on loan when an
+    # existing book is updated, so its availability is derived from the new
+    # quantity rather than taken from the file. Rows whose quantity is below
+    # the copies on loan are rejected before they get here.
+    'upsert': '''INSERT INTO books (book_id, title, author, isbn, category, quantity, available, status)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                 ON CONFLICT (book_id) DO UPDATE SET
+                     title = excluded.title,
+                     author = excluded.author,
+                     isbn = excluded.isbn,
+                     category = excluded.category,
+                     quantity = excluded.quantity,
+                     available = excluded.quantity - (books.quantity - books.available),
+                     status = CASE WHEN excluded.quantity - (books.quantity - books.available) > 0
+                                   THEN 'Available' ELSE 'Out of Stock' END''',
+}
+
+
+class ImportStats:
+    def __init__(self, total_bytes=None):
+        self.read = 0
+        self.written = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors = []
+        self.bytes_read = 0
+        self.total_bytes = total_bytes
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def fraction(self):
+        if not self.total_bytes:
+            return None
+        return min(1.0, self.bytes_read / self.total_bytes)
+
+    def summary(self):
+        return (f"{self.read} rows read, {self.written} written, {self.skipped} duplicates skipped, "
+                f"{self.invalid} invalid in {self.elapsed:.1f}s ({self.rows_per_sec:,.0f} rows/s)")
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+def _int(value, name, default):
+    text = _text(value)
+    if text == '':
+        return default
+    try:
+        number = int(float(text))
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number, got {text!r}")
+    if number < 0:
+        raise ValueError(f"{name} cannot be negative")
+    return number
+
+def validate_book(record):
+    # Turns one input record into a books row, raising ValueError if it is unusable
+    book_id, title, author = _text(record.get('book_id')), _text(record.get('title')), _text(record.get('author'))
+    if not book_id or not title or not author:
+        raise ValueError("book_id, title and author are required")
+    quantity = _int(record.get('quantity'), 'quantity', 1)
+    available = _int(record.get('available'), 'available', quantity)
+    if available > quantity:
+        raise ValueError(f"available ({available}) exceeds quantity ({quantity})")
+    status = _text(record.get('status')) or ('Available' if available > 0 else 'Out of Stock')
+    return (book_id, title, author, _text(record.get('isbn')) or None, _text(record.get('category')) or None,
+            quantity, available, status)
+
+
+def _read_csv(text):
+    reader = csv.DictReader(text)
+    for record in reader:
+        yield reader.line_num, record
+
+def _read_jsonl(text):
+    for line_no, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, ValueError(f"invalid JSON: {e.msg}")
+            continue
+        yield line_no, record if isinstance(record, dict) else ValueError("expected a JSON object")
+
+def detect_format(name):
+    fmt = FORMATS.get(os.path.splitext(name or '')[1].lower())
+    if fmt is None:
+        raise ValueError(f"Cannot tell the format of {name!r}; use a .csv or .jsonl file")
+    return fmt
+
+
+def _reject(stats, line_no, message):
+    stats.invalid += 1
+    if len(stats.errors) < MAX_ERRORS:
+        stats.errors.append(f"line {line_no}: {message}")
+
+def _copies_on_loan(conn, book_ids):
+    # Copies of each existing book that are on loan now, for the book_ids given
+    book_ids = list(set(book_ids))
+    on_loan = {}
+    for start in range(0, len(book_ids), 500):
+        chunk = book_ids[start:start + 500]
+        c = conn.execute(f"""SELECT book_id, quantity - available FROM books
+                             WHERE book_id IN ({', '.join('?' * len(chunk))}) AND available < quantity""", chunk)
+        on_loan.update(c.fetchall())
+    return on_loan
+
+def _flush(conn, sql, batch, stats, on_duplicate):
+    # `batch` holds (line number, row) pairs. An upsert may not cut a book's
+    # quantity below its copies on loan; the check and the write share one
+    # write transaction, so no borrow can commit in between.
+    conn.execute("BEGIN IMMEDIATE")
+    on_loan = _copies_on_loan(conn, [row[0] for _, row in batch]) if on_duplicate == 'upsert' else {}
+    rows = []
+    for line_no, row in batch:
+        book_id, quantity = row[0], row[5]
+        if quantity < on_loan.get(book_id, 0):
+            _reject(stats, line_no, f"quantity ({quantity}) is below the {on_loan[book_id]} copies of {book_id} on loan")
+        else:
+            rows.append(row)
+    c = conn.executemany(sql, rows)
+    conn.commit()
+    database.invalidate_cache()
+    stats.written += c.rowcount
+    stats.skipped += len(rows) - c.rowcount
+
+def import_books(source, fmt=None, on_duplicate='skip', batch_size=BATCH_SIZE, defer_indexes=False,
+                 progress=None):
+    # `source` is a path or a binary file object (e.g. a Streamlit upload).
+    # `progress` is called with the running ImportStats after every batch.
+    # With `defer_indexes` the secondary indexes and FTS index are dropped
+    # for the load and the Dashboard counters stop updating; all of them are
+    # rebuilt once at the end. That is much faster for large loads, but search
+    # falls back to a slower scan and the Dashboard shows the figures from
+    # before the load until it finishes.
+    if on_duplicate not in DUPLICATE_MODES:
+        raise ValueError(f"on_duplicate must be one of {DUPLICATE_MODES}")
+
+    if isinstance(source, (str, os.PathLike)):
+        binary = open(source, 'rb')
+        name = os.fspath(source)
+        total_bytes = os.fstat(binary.fileno()).st_size
+    else:
+        binary = source
+        name = getattr(source, 'name', None)
+        total_bytes = getattr(source, 'size', None)
+    fmt = fmt or detect_format(name)
+    text = io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+    records = _read_csv(text) if fmt == 'csv' else _read_jsonl(text)
+
+    stats = ImportStats(total_bytes)
+    sql = INSERT_SQL[on_duplicate]
+    try:
+        with database.get_connection() as conn:
+            if defer_indexes:
+                database.drop_books_maintenance(conn)
+            try:
+                batch = []
+                for line_no, record in records:
+                    stats.read += 1
+                    try:
+                        if isinstance(record, Exception):
+                            raise record
+                        batch.append((line_no, validate_book(record)))
+                    except ValueError as e:
+                        _reject(stats, line_no, e)
+                    if len(batch) >= batch_size:
+                        _flush(conn, sql, batch, stats, on_duplicate)
+                        batch = []
+                        stats.bytes_read = binary.tell()
+                        stats.elapsed = time.perf_counter() - stats.started
+                        if progress:
+                            progress(stats)
+                if batch:
+                    _flush(conn, sql, batch, stats, on_duplicate)
+            finally:
+                # A failed batch is discarded before anything else is committed
+                if conn.in_transaction:
+                    conn.rollback()
+                if defer_indexes:
+                    database.restore_books_maintenance(conn)
+    finally:
+        if isinstance(source, (str, os.PathLike)):
+            text.close()
+        else:
+            # Leave the caller's file object open
+            text.detach()
+
+    stats.bytes_read = total_bytes or stats.bytes_read
+    stats.elapsed = time.perf_counter() - stats.started
+    if progress:
+        progress(stats)
+    return stats
@@ -0,0 +1,1523 @@
+import os
+import re
+import sqlite3
+import hashlib
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+import metrics
+from group_commit import GroupCommitWriter
+from query_cache import QueryCache
+
+# Connection settings (overridable through the environment)
+DB_PATH = os.environ.get('LIBRARY_DB', 'library.db')
+POOL_SIZE = int(os.environ.get('LIBRARY_DB_POOL_SIZE', '8'))
+BUSY_TIMEOUT_MS = int(os.environ.get('LIBRARY_DB_BUSY_TIMEOUT_MS', '5000'))
+CACHE_SIZE_KB = int(os.environ.get('LIBRARY_DB_CACHE_SIZE_KB', '20000'))
+MMAP_SIZE = int(os.environ.get('LIBRARY_DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+QUERY_CACHE_MB = int(os.environ.get('LIBRARY_QUERY_CACHE_MB', '64'))
+REPLICA_ENABLED = os.environ.get('LIBRARY_REPLICA', '0') == '1'
+REPLICA_PATH = os.environ.get('LIBRARY_REPLICA_PATH')
+REPLICA_MAX_STALENESS_S = float(os.environ.get('LIBRARY_REPLICA_MAX_STALENESS_S', '5'))
+# Refreshing at half the staleness bound keeps the copy within it while a
+# full copy takes less than the other half
+REPLICA_REFRESH_INTERVAL_S = float(os.environ.get('LIBRARY_REPLICA_REFRESH_INTERVAL_S', str(REPLICA_MAX_STALENESS_S / 2)))
+# Largest share of the time the replica may spend copying. A copy that took
+# 200 ms is not repeated within 2 s at the default 0.1, however busy writes are.
+REPLICA_MAX_COPY_SHARE = float(os.environ.get('LIBRARY_REPLICA_MAX_COPY_SHARE', '0.1'))
+GROUP_COMMIT = os.environ.get('LIBRARY_GROUP_COMMIT', '1') != '0'
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('LIBRARY_GROUP_COMMIT_WINDOW_MS', '0'))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('LIBRARY_GROUP_COMMIT_MAX_BATCH', '256'))
+
+
+# Connection pool
+# Streamlit re-executes main.py on every rerun, so anything process-wide has to
+# live in an imported module like this one. Connections are opened lazily up to
+# `size`, handed out LIFO so hot connections keep a warm page cache, and pinned
+# to the checking-out thread so nested helper calls share one connection.
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, read_only=False):
+        self.path = path
+        self.size = max(1, size)
+        self.read_only = read_only
+        self._idle = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                               factory=metrics.connection_factory())
+        if not self.read_only:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=ON")
+        if self.read_only:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def acquire(self):
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped instead of going back to the pool
+            conn.close()
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            if self._closed:
+                # Checked out before close(); closed now instead of pooled
+                conn.close()
+                self._created -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+        conn = self.acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle = []
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure(path=None, pool_size=None):
+    global _pool, DB_PATH, POOL_SIZE, _migrated_path
+    stop_replica()
+    with _pool_lock:
+        if path is not None:
+            DB_PATH = path
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(DB_PATH, POOL_SIZE)
+        _migrated_path = None
+    _close_version_connection()
+    query_cache.reset()
+    return _pool
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH, POOL_SIZE)
+    return _pool
+
+def get_connection():
+    return get_pool().connection()
+
+
+# Query cache
+# PRAGMA data_version is per connection and only moves when *another*
+# connection commits, so it is read from a dedicated connection that never
+# writes; any commit through the pool or from another process changes it.
+_version_conn = None
+_version_lock = threading.Lock()
+
+def get_data_version():
+    global _version_conn
+    with _version_lock:
+        if _version_conn is None:
+            _version_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        return _version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+def _close_version_connection():
+    global _version_conn
+    with _version_lock:
+        if _version_conn is not None:
+            _version_conn.close()
+            _version_conn = None
+
+query_cache = QueryCache(QUERY_CACHE_MB * 1024 * 1024, version_func=get_data_version)
+cached_query = query_cache.cached
+
+def invalidate_cache():
+    query_cache.invalidate()
+
+def get_cache_stats():
+    return query_cache.stats()
+
+
+# Group commit
+# Every write helper hands its work to one writer thread as an `op(conn)`
+# callable and waits on the returned future; see group_commit.py. With
+# LIBRARY_GROUP_COMMIT=0 each op runs in its own transaction on the caller's
+# thread instead.
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = GroupCommitWriter(get_connection, lambda conn: _begin_immediate(conn), invalidate_cache,
+                                            GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH)
+    return _writer
+
+def submit_write(op):
+    # Returns a Future for op's result, or for the exception it raised
+    writer = get_writer()
+    return writer.submit(op) if GROUP_COMMIT else writer.run_inline(op)
+
+def run_write(op):
+    return submit_write(op).result()
+
+def get_write_stats():
+    return get_writer().stats()
+
+
+# Read replica
+# With LIBRARY_REPLICA=1 a background thread keeps a read-only copy of the
+# database next to it, refreshed with SQLite's online backup API whenever
+# PRAGMA data_version shows a commit the copy does not have yet, but never
+# more often than REPLICA_MAX_COPY_SHARE of the time allows. Reads that
+# opt in (search, and the student catalog pages) are served from the copy's
+# own connection pool, so heavy read traffic never holds snapshots, page cache
+# or WAL checkpoints on the primary that staff writes depend on. A copy that is
+# missing commits and is older than REPLICA_MAX_STALENESS_S is not used; those
+# reads fall back to the primary until the next refresh.
+class ReadReplica:
+    def __init__(self, path, max_staleness=REPLICA_MAX_STALENESS_S, interval=REPLICA_REFRESH_INTERVAL_S):
+        self.path = path
+        self.max_staleness = max_staleness
+        self.interval = interval
+        self.pool = None
+        self.version = None
+        self.refreshed_at = None
+        self.refreshes = 0
+        self.last_refresh_ms = 0.0
+        self.reads = 0
+        self.fallbacks = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name='read-replica', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.pool is not None:
+            self.pool.close()
+
+    def due(self):
+        # A commit is missing and the last copy has been paid for
+        min_gap = self.last_refresh_ms / 1000 / REPLICA_MAX_COPY_SHARE
+        return get_data_version() != self.version and time.time() - self.refreshed_at >= min_gap
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.due():
+                    self.refresh()
+            except (sqlite3.Error, OSError) as e:
+                # Reads fall back to the primary once the copy is too stale
+                self.last_error = str(e)
+
+    def refresh(self):
+        # Copies the primary in one backup step into a private file with no
+        # journal, so the copy writes the database once and no WAL, then
+        # renames it over the replica and swaps in a pool on the new file.
+        # Reads still running on the old copy finish there; its pool closes
+        # their connections as they come back. The version is read first, so
+        # a commit that lands during the copy triggers another refresh.
+        with self._lock:
+            version = get_data_version()
+            started_at = time.time()
+            started = time.perf_counter()
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            dest = sqlite3.connect(tmp_path)
+            try:
+                dest.execute("PRAGMA journal_mode=OFF")
+                dest.execute("PRAGMA synchronous=OFF")
+                with get_connection() as source:
+                    source.backup(dest)
+                # The copy carries the primary's WAL flag; readers of a file
+                # in rollback mode never create -wal or -shm files beside it
+                dest.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                dest.close()
+            os.replace(tmp_path, self.path)
+            old_pool, self.pool = self.pool, ConnectionPool(self.path, POOL_SIZE, read_only=True)
+            if old_pool is not None:
+                old_pool.close()
+            self.version = version
+            self.refreshed_at = started_at
+            self.refreshes += 1
+            self.last_refresh_ms = (time.perf_counter() - started) * 1000
+            self.last_error = None
+        # Cached results read from the previous copy are dropped
+        invalidate_cache()
+
+    def staleness(self):
+        # Seconds of commits the copy may be missing (0 when it is current)
+        if self.refreshed_at is None:
+            return None
+        return 0.0 if get_data_version() == self.version else time.time() - self.refreshed_at
+
+    def fresh_pool(self):
+        pool = self.pool
+        if pool is not None and (time.time() - self.refreshed_at <= self.max_staleness
+                                 or get_data_version() == self.version):
+            with self._stats_lock:
+                self.reads += 1
+            return pool
+        with self._stats_lock:
+            self.fallbacks += 1
+        return None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'path': self.path,
+                'staleness_s': self.staleness(),
+                'max_staleness_s': self.max_staleness,
+                'refreshes': self.refreshes,
+                'last_refresh_ms': self.last_refresh_ms,
+                'reads': self.reads,
+                'fallbacks': self.fallbacks,
+                'last_error': self.last_error,
+            }
+
+_replica = None
+_replica_lock = threading.Lock()
+
+def replica_path():
+    return REPLICA_PATH or f"{os.path.splitext(DB_PATH)[0]}.replica.db"
+
+def start_replica():
+    # Called by the long-running entry points (the app and the API) only, so
+    # one-off commands like manage.py never spend time on a snapshot copy
+    global _replica
+    with _replica_lock:
+        if _replica is None:
+            replica = ReadReplica(replica_path())
+            replica.start()
+            _replica = replica
+    return _replica
+
+def stop_replica():
+    global _replica
+    with _replica_lock:
+        if _replica is not None:
+            _replica.stop()
+            _replica = None
+
+def get_replica_stats():
+    replica = _replica
+    return replica.stats() if replica is not None else None
+
+def get_read_connection(replica=False):
+    # A pooled connection on the replica when asked for and fresh enough,
+    # otherwise on the primary
+    pool = _replica.fresh_pool() if replica and _replica is not None else None
+    return (pool or get_pool()).connection()
+
+
+# Full-text search index over the catalog. It is an external-content FTS5 table
+# (no second copy of the text) kept in sync by triggers; the update trigger only
+# fires for indexed columns so availability changes never touch the index.
+BOOKS_FTS_SCHEMA = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5
+       (book_id, title, author, category,
+        content='books', content_rowid='rowid',
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2')''',
+    '''CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+         INSERT INTO books_fts (rowid, book_id, title, author, category)
+         VALUES (new.rowid, new.book_id, new.title, new.author, new.category);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+         INSERT INTO books_fts (books_fts, rowid, book_id, title, author, category)
+         VALUES ('delete', old.rowid, old.book_id, old.title, old.author, old.category);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF book_id, title, author, category ON books BEGIN
+         INSERT INTO books_fts (books_fts, rowid, book_id, title, author, category)
+         VALUES ('delete', old.rowid, old.book_id, old.title, old.author, old.category);
+         INSERT INTO books_fts (rowid, book_id, title, author, category)
+         VALUES (new.rowid, new.book_id, new.title, new.author, new.category);
+       END''',
+]
+
+# Dashboard counters, maintained by triggers so the Dashboard reads a handful of
+# rows instead of aggregating the catalog. catalog_stats holds a single row;
+# category_stats has one row per non-NULL category.
+CATALOG_STATS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS catalog_stats
+       (id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_titles INTEGER NOT NULL,
+        total_copies INTEGER NOT NULL,
+        available_copies INTEGER NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS category_stats
+       (category TEXT PRIMARY KEY NOT NULL,
+        titles INTEGER NOT NULL,
+        copies INTEGER NOT NULL,
+        available INTEGER NOT NULL)''',
+    '''CREATE TRIGGER IF NOT EXISTS catalog_stats_ai AFTER INSERT ON books BEGIN
+         UPDATE catalog_stats SET total_titles = total_titles + 1,
+                                  total_copies = total_copies + IFNULL(new.quantity, 0),
+                                  available_copies = available_copies + IFNULL(new.available, 0)
+         WHERE id = 1;
+         INSERT INTO category_stats (category, titles, copies, available)
+         SELECT new.category, 1, IFNULL(new.quantity, 0), IFNULL(new.available, 0)
+         WHERE new.category IS NOT NULL
+         ON CONFLICT (category) DO UPDATE SET titles = titles + 1,
+                                              copies = copies + excluded.copies,
+                                              available = available + excluded.available;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS catalog_stats_ad AFTER DELETE ON books BEGIN
+         UPDATE catalog_stats SET total_titles = total_titles - 1,
+                                  total_copies = total_copies - IFNULL(old.quantity, 0),
+                                  available_copies = available_copies - IFNULL(old.available, 0)
+         WHERE id = 1;
+         UPDATE category_stats SET titles = titles - 1,
+                                   copies = copies - IFNULL(old.quantity, 0),
+                                   available = available - IFNULL(old.available, 0)
+         WHERE category = old.category;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS catalog_stats_au AFTER UPDATE OF quantity, available, category ON books BEGIN
+         UPDATE catalog_stats SET total_copies = total_copies - IFNULL(old.quantity, 0) + IFNULL(new.quantity, 0),
+                                  available_copies = available_copies - IFNULL(old.available, 0) + IFNULL(new.available, 0)
+         WHERE id = 1;
+         UPDATE category_stats SET titles = titles - 1,
+                                   copies = copies - IFNULL(old.quantity, 0),
+                                   available = available - IFNULL(old.available, 0)
+         WHERE category = old.category;
+         INSERT INTO category_stats (category, titles, copies, available)
+         SELECT new.category, 1, IFNULL(new.quantity, 0), IFNULL(new.available, 0)
+         WHERE new.category IS NOT NULL
+         ON CONFLICT (category) DO UPDATE SET titles = titles + 1,
+                                              copies = copies + excluded.copies,
+                                              available = available + excluded.available;
+       END''',
+]
+CATALOG_STATS_TABLES = ('catalog_stats', 'category_stats')
+CATALOG_STATS_TRIGGERS = ('catalog_stats_ai', 'catalog_stats_ad', 'catalog_stats_au')
+
+# Search fields offered by the "Search Books" page, mapped to FTS columns
+SEARCH_FIELDS = {
+    'All Fields': ['title', 'author', 'category'],
+    'Title': ['title'],
+    'Author': ['author'],
+    'Category': ['category'],
+    'Book ID': ['book_id'],
+}
+SEARCH_LIMIT = 50
+
+# Catalog columns that callers may project, and the keyset-paginated sort orders.
+# Every sort key is paired with book_id (or is unique on its own) so a page
+# boundary is always a single row; nullable columns are not offered as keys.
+BOOK_COLUMNS = ['book_id', 'title', 'author', 'isbn', 'category', 'quantity', 'available', 'status']
+BOOK_SORT_FIELDS = {
+    'Book ID': 'book_id',
+    'Title': 'title',
+    'Author': 'author',
+    'Recently Added': 'rowid',
+}
+PAGE_SIZE = 25
+
+# Secondary indexes on books backing the sorted and filtered catalog pages
+BOOKS_INDEXES = [
+    ('idx_books_title', '(title, book_id)'),
+    ('idx_books_author', '(author, book_id)'),
+    ('idx_books_category', '(category, book_id)'),
+    ('idx_books_id_nocase', '(book_id COLLATE NOCASE)'),
+    ('idx_books_isbn_nocase', '(isbn COLLATE NOCASE)'),
+]
+
+# Indexes on loans for open-loan, overdue, per-borrower and return lookups.
+# The status/due date and patron indexes carry the join keys, so those scans
+# never touch the loans table itself.
+LOAN_INDEXES = [
+    ('idx_loans_status_due', '(status, due_date, book_id, patron_id)'),
+    ('idx_loans_patron_status', '(patron_id, status, borrow_date)'),
+    ('idx_loans_book_patron_status', '(book_id, patron_id, status)'),
+]
+
+# Loans
+# Loans reference books and patrons by integer key instead of copying the
+# title and borrower name into every row, and PRAGMA foreign_keys is on for
+# every pooled connection. borrowed_books and loan_history are views with the
+# old column layout for exports and ad-hoc queries.
+#
+# Returned loans past ARCHIVE_AFTER_DAYS move from loans into loan_archive so
+# the hot table only grows with recent circulation.
+ARCHIVE_AFTER_DAYS = int(os.environ.get('LIBRARY_ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = 5000
+LOAN_COLUMNS = ['id', 'book_id', 'title', 'borrower_name', 'borrower_id', 'borrow_date', 'due_date', 'status']
+LOAN_KEY_COLUMNS = ['id', 'book_id', 'patron_id', 'borrow_date', 'due_date', 'status', 'returned_date']
+
+LOANS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS patrons
+       (id INTEGER PRIMARY KEY,
+        borrower_id TEXT NOT NULL UNIQUE,
+        name TEXT NOT NULL,
+        username TEXT REFERENCES users (username) ON DELETE SET NULL)''',
+    "CREATE INDEX IF NOT EXISTS idx_patrons_borrower_nocase ON patrons (borrower_id COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS idx_patrons_username ON patrons (username)",
+    '''CREATE TABLE IF NOT EXISTS loans
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER NOT NULL REFERENCES books (id),
+        patron_id INTEGER NOT NULL REFERENCES patrons (id),
+        borrow_date DATE,
+        due_date DATE,
+        status TEXT NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS loan_archive
+       (id INTEGER PRIMARY KEY,
+        book_id INTEGER NOT NULL REFERENCES books (id),
+        patron_id INTEGER NOT NULL REFERENCES patrons (id),
+        borrow_date DATE,
+        due_date DATE,
+        status TEXT NOT NULL,
+        archived_date DATE)''',
+    "CREATE INDEX IF NOT EXISTS idx_loan_archive_patron ON loan_archive (patron_id, borrow_date)",
+    "CREATE INDEX IF NOT EXISTS idx_loan_archive_book ON loan_archive (book_id)",
+    "CREATE INDEX IF NOT EXISTS idx_loan_archive_borrow_date ON loan_archive (borrow_date)",
+    '''CREATE TABLE IF NOT EXISTS orphaned_loans
+       (id INTEGER PRIMARY KEY,
+        book_id TEXT,
+        title TEXT,
+        borrower_name TEXT,
+        borrower_id TEXT,
+        borrow_date DATE,
+        due_date DATE,
+        status TEXT,
+        archived_date DATE)''',
+]
+
+def loan_select(table='loans', returned_date=True):
+    # Loan rows in the old borrowed_books layout plus the return date, from
+    # `table` (loans or loan_archive) aliased as l. returned_date=False
+    # leaves the return date out, for migration 8 which runs before the
+    # column exists.
+    return_column = ", l.returned_date" if returned_date else ""
+    return f"""SELECT l.id AS id, b.book_id, b.title, p.name AS borrower_name, p.borrower_id,
+                      l.borrow_date, l.due_date, l.status{return_column}
+               FROM {table} l
+               JOIN books b ON b.id = l.book_id
+               JOIN patrons p ON p.id = l.patron_id"""
+
+def loan_views(returned_date=True):
+    # orphaned_loans keeps the old columns and never has a return date
+    orphan_return_column = ", NULL AS returned_date" if returned_date else ""
+    return [
+        f"CREATE VIEW IF NOT EXISTS borrowed_books AS {loan_select('loans', returned_date)}",
+        f"""CREATE VIEW IF NOT EXISTS loan_history AS
+            {loan_select('loans', returned_date)}
+            UNION ALL {loan_select('loan_archive', returned_date)}
+            UNION ALL SELECT {', '.join(LOAN_COLUMNS)}{orphan_return_column} FROM orphaned_loans""",
+    ]
+
+# Schema as of migrations 5-7, before loans were normalized; kept so that
+# those steps still replay the same way on a new database
+LEGACY_LOAN_INDEXES = [
+    ('idx_loans_status_due', '(status, due_date)'),
+    ('idx_loans_borrower_status', '(borrower_id, status)'),
+    ('idx_loans_book_borrower_status', '(book_id, borrower_id, status)'),
+    ('idx_loans_status_borrower_nocase', '(status, borrower_id COLLATE NOCASE)'),
+]
+LEGACY_LOAN_ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS loan_archive
+       (id INTEGER PRIMARY KEY,
+        book_id TEXT,
+        title TEXT,
+        borrower_name TEXT,
+        borrower_id TEXT,
+        borrow_date DATE,
+        due_date DATE,
+        status TEXT,
+        archived_date DATE)''',
+    "CREATE INDEX IF NOT EXISTS idx_loan_archive_borrower ON loan_archive (borrower_id, borrow_date)",
+    "CREATE INDEX IF NOT EXISTS idx_loan_archive_borrow_date ON loan_archive (borrow_date)",
+    f'''CREATE VIEW IF NOT EXISTS loan_history AS
+        SELECT {', '.join(LOAN_COLUMNS)} FROM borrowed_books
+        UNION ALL
+        SELECT {', '.join(LOAN_COLUMNS)} FROM loan_archive''',
+]
+
+# Circulation rollups
+# The Dashboard's circulation charts read only these tables. Triggers on loans
+# add each borrow and each return as it is written; archiving deletes from
+# loans without touching them, so the rollups keep covering archived history.
+# Demand is counted against a book's current category, so a category change
+# moves that book's loans along with it.
+CIRCULATION_HISTORY = """SELECT book_id, borrow_date, due_date, returned_date FROM loans
+                         UNION ALL SELECT book_id, borrow_date, due_date, returned_date FROM loan_archive"""
+_COUNT_RETURN = '''INSERT INTO circulation_daily (day, returned, returned_late)
+         VALUES (new.returned_date, 1, IFNULL(new.returned_date > new.due_date, 0))
+         ON CONFLICT (day) DO UPDATE SET returned = returned + 1,
+                                         returned_late = returned_late + excluded.returned_late;'''
+CIRCULATION_STATS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS circulation_daily
+       (day DATE PRIMARY KEY,
+        borrowed INTEGER NOT NULL DEFAULT 0,
+        returned INTEGER NOT NULL DEFAULT 0,
+        returned_late INTEGER NOT NULL DEFAULT 0)''',
+    '''CREATE TABLE IF NOT EXISTS book_circulation
+       (book_id INTEGER PRIMARY KEY,
+        loans INTEGER NOT NULL)''',
+    "CREATE INDEX IF NOT EXISTS idx_book_circulation_loans ON book_circulation (loans)",
+    '''CREATE TABLE IF NOT EXISTS category_circulation
+       (category TEXT PRIMARY KEY,
+        loans INTEGER NOT NULL)''',
+    '''CREATE TRIGGER IF NOT EXISTS circulation_ai AFTER INSERT ON loans BEGIN
+         INSERT INTO circulation_daily (day, borrowed)
+         SELECT new.borrow_date, 1 WHERE new.borrow_date IS NOT NULL
+         ON CONFLICT (day) DO UPDATE SET borrowed = borrowed + 1;
+         INSERT INTO book_circulation (book_id, loans) VALUES (new.book_id, 1)
+         ON CONFLICT (book_id) DO UPDATE SET loans = loans + 1;
+         INSERT INTO category_circulation (category, loans)
+         SELECT category, 1 FROM books WHERE id = new.book_id AND category IS NOT NULL
+         ON CONFLICT (category) DO UPDATE SET loans = loans + 1;
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS circulation_returned_ai AFTER INSERT ON loans
+       WHEN new.returned_date IS NOT NULL BEGIN
+         {_COUNT_RETURN}
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS circulation_returned_au AFTER UPDATE OF returned_date ON loans
+       WHEN old.returned_date IS NULL AND new.returned_date IS NOT NULL BEGIN
+         {_COUNT_RETURN}
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS circulation_category_au AFTER UPDATE OF category ON books
+       WHEN old.category IS NOT new.category BEGIN
+         UPDATE category_circulation
+         SET loans = loans - IFNULL((SELECT loans FROM book_circulation WHERE book_id = old.id), 0)
+         WHERE category = old.category;
+         INSERT INTO category_circulation (category, loans)
+         SELECT new.category, loans FROM book_circulation WHERE book_id = new.id AND new.category IS NOT NULL
+         ON CONFLICT (category) DO UPDATE SET loans = loans + excluded.loans;
+       END''',
+]
+CIRCULATION_TRIGGERS = ('circulation_ai', 'circulation_returned_ai', 'circulation_returned_au', 'circulation_category_au')
+CIRCULATION_TABLES = ('circulation_daily', 'book_circulation', 'category_circulation')
+CIRCULATION_DAYS = 90
+CIRCULATION_MONTHS = 24
+MOST_BORROWED_LIMIT = 10
+
+# Typed reads
+# DataFrames are built against a declared schema instead of pandas' default
+# object columns: low-cardinality text is categorical, counts are nullable
+# integers and ISO dates are parsed once at load time rather than on every
+# page view. LIBRARY_DATAFRAME_BACKEND=pyarrow stores text, integers and
+# dates as Arrow arrays instead (needs pyarrow).
+DATAFRAME_BACKEND = os.environ.get('LIBRARY_DATAFRAME_BACKEND', 'numpy')
+
+BOOK_SCHEMA = {'book_id': 'string', 'title': 'string', 'author': 'string', 'isbn': 'string',
+               'category': 'category', 'quantity': 'int32', 'available': 'int32', 'status': 'category'}
+LOAN_SCHEMA = {'id': 'int64', 'book_id': 'string', 'title': 'string', 'borrower_name': 'string',
+               'borrower_id': 'string', 'borrow_date': 'date', 'due_date': 'date', 'status': 'category',
+               'returned_date': 'date', 'archived_date': 'date'}
+CATEGORY_COUNTS_SCHEMA = {'category': 'string', 'titles': 'int32', 'copies': 'int32', 'available': 'int32'}
+CIRCULATION_SCHEMA = {'day': 'date', 'month': 'string', 'book_id': 'string', 'title': 'string', 'author': 'string',
+                      'category': 'string', 'borrowed': 'int32', 'returned': 'int32', 'returned_late': 'int32',
+                      'late_rate': 'float64', 'loans': 'int32'}
+
+def arrow_backend():
+    return DATAFRAME_BACKEND == 'pyarrow' and pa is not None
+
+def typed_frame(df, schema):
+    # Converts the columns of `df` named in `schema`, in place
+    arrow = arrow_backend()
+    for col, kind in schema.items():
+        if col not in df.columns:
+            continue
+        if kind == 'date':
+            parsed = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
+            df[col] = parsed.astype(pd.ArrowDtype(pa.date32())) if arrow else parsed
+        elif kind == 'category':
+            df[col] = df[col].astype('category')
+        elif arrow:
+            df[col] = df[col].astype(pd.ArrowDtype(pa.string() if kind == 'string' else getattr(pa, kind)()))
+        else:
+            df[col] = df[col].astype('string' if kind == 'string' else kind.capitalize())
+    return df
+
+def read_frame(conn, sql, schema, params=None):
+    return typed_frame(pd.read_sql_query(sql, conn, params=params), schema)
+
+# Password hashing
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+# Database setup
+# Schema changes are ordered, idempotent migration steps. PRAGMA user_version
+# records the last step applied, and init_db() runs them at most once per
+# process and database path, so a Streamlit rerun does no schema work at all.
+def _migrate_base_tables(conn):
+    c = conn.cursor()
+
+    # Create users table with roles
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (username TEXT PRIMARY KEY,
+                  password TEXT NOT NULL,
+                  full_name TEXT NOT NULL,
+                  email TEXT,
+                  role TEXT NOT NULL,
+                  created_date DATE)''')
+
+    # Create books table
+    c.execute('''CREATE TABLE IF NOT EXISTS books
+                 (book_id TEXT PRIMARY KEY,
+                  title TEXT NOT NULL,
+                  author TEXT NOT NULL,
+                  isbn TEXT,
+                  category TEXT,
+                  quantity INTEGER,
+                  available INTEGER,
+                  status TEXT)''')
+
+    # Create borrowed_books table
+    c.execute('''CREATE TABLE IF NOT EXISTS borrowed_books
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  book_id TEXT,
+                  title TEXT,
+                  borrower_name TEXT,
+                  borrower_id TEXT,
+                  borrow_date DATE,
+                  due_date DATE,
+                  status TEXT)''')
+
+    # Check if default users exist
+    c.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
+    if c.fetchone()[0] == 0:
+        # Create default accounts
+        default_users = [
+            ('admin', hash_password('admin123'), 'System Administrator', 'admin@library.com', 'Administrator', datetime.now().date()),
+            ('staff', hash_password('staff123'), 'Library Staff', 'staff@library.com', 'Library Staff', datetime.now().date()),
+            ('student', hash_password('student123'), 'Student User', 'student@library.com', 'Student', datetime.now().date())
+        ]
+        c.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", default_users)
+
+    # Check if tables are empty and add sample data
+    c.execute("SELECT COUNT(*) FROM books")
+    if c.fetchone()[0] == 0:
+        sample_books = [
+            ('B001', 'Python Programming', 'John Smith', '978-1234567890', 'Programming', 5, 5, 'Available'),
+            ('B002', 'Data Science Handbook', 'Jane Doe', '978-0987654321', 'Data Science', 3, 3, 'Available'),
+            ('B003', 'Web Development Guide', 'Mike Johnson', '978-1122334455', 'Web Development', 7, 7, 'Available')
+        ]
+        c.executemany("INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)", sample_books)
+
+def _migrate_normalized_loans(conn):
+    # Replaces borrowed_books and the old loan_archive with loans keyed by
+    # integer book and patron ids. books gets an INTEGER PRIMARY KEY copied
+    # from its rowid, which keeps the full-text index valid. migrate() runs
+    # this with foreign key enforcement off, as SQLite requires for a rebuild.
+    conn.execute("DROP VIEW IF EXISTS loan_history")
+    conn.execute('''CREATE TABLE books_new
+                    (id INTEGER PRIMARY KEY,
+                     book_id TEXT NOT NULL UNIQUE,
+                     title TEXT NOT NULL,
+                     author TEXT NOT NULL,
+                     isbn TEXT,
+                     category TEXT,
+                     quantity INTEGER,
+                     available INTEGER,
+                     status TEXT)''')
+    conn.execute(f"INSERT INTO books_new (id, {', '.join(BOOK_COLUMNS)}) SELECT rowid, {', '.join(BOOK_COLUMNS)} FROM books")
+    conn.execute("DROP TABLE books")
+    conn.execute("ALTER TABLE books_new RENAME TO books")
+    # Dropping books took its indexes and triggers with it
+    ensure_books_indexes(conn)
+    ensure_books_fts(conn)
+    ensure_catalog_stats(conn)
+
+    conn.execute("DROP INDEX IF EXISTS idx_loan_archive_borrower")
+    conn.execute("DROP INDEX IF EXISTS idx_loan_archive_borrow_date")
+    conn.execute("ALTER TABLE loan_archive RENAME TO loan_archive_old")
+    for statement in LOANS_SCHEMA:
+        conn.execute(statement)
+    old_loans = f"""SELECT {', '.join(LOAN_COLUMNS)} FROM borrowed_books
+                    UNION ALL SELECT {', '.join(LOAN_COLUMNS)} FROM loan_archive_old"""
+
+    # Loans without a borrower ID, or of a book that is no longer in the
+    # catalog, cannot reference a book and patron. They are kept as they were
+    # in orphaned_loans, outside the live catalog, and still appear in
+    # loan_history.
+    orphaned = """IFNULL(TRIM(l.book_id), '') = '' OR IFNULL(TRIM(l.borrower_id), '') = ''
+                  OR l.book_id NOT IN (SELECT book_id FROM books)"""
+    for source, archived_date in (('borrowed_books', 'NULL'), ('loan_archive_old', 'l.archived_date')):
+        conn.execute(f"""INSERT INTO orphaned_loans ({', '.join(LOAN_COLUMNS)}, archived_date)
+                         SELECT {', '.join('l.' + col for col in LOAN_COLUMNS)}, {archived_date}
+                         FROM {source} l WHERE {orphaned}""")
+    # One patron per borrower ID, named as on their latest loan and linked
+    # to the user account with the same name, if any
+    conn.execute(f"""INSERT INTO patrons (borrower_id, name, username)
+                     SELECT l.borrower_id, IFNULL(l.borrower_name, l.borrower_id), u.username
+                     FROM (SELECT borrower_id, borrower_name, MAX(id) FROM ({old_loans}) l
+                           WHERE NOT ({orphaned}) GROUP BY borrower_id) l
+                     LEFT JOIN users u ON u.username = l.borrower_id""")
+    for target, source, extra in (('loans', 'borrowed_books', ''),
+                                  ('loan_archive', 'loan_archive_old', ', archived_date')):
+        conn.execute(f"""INSERT INTO {target} (id, book_id, patron_id, borrow_date, due_date, status{extra})
+                         SELECT l.id, b.id, p.id, l.borrow_date, l.due_date, IFNULL(l.status, 'Borrowed'){extra}
+                         FROM {source} l
+                         JOIN books b ON b.book_id = l.book_id
+                         JOIN patrons p ON p.borrower_id = l.borrower_id""")
+    # New loan ids continue after every id borrowed_books ever handed out
+    c = conn.execute("""SELECT MAX(seq) FROM (SELECT seq FROM sqlite_sequence WHERE name IN ('borrowed_books', 'loans')
+                                              UNION ALL SELECT MAX(id) FROM loan_archive
+                                              UNION ALL SELECT MAX(id) FROM orphaned_loans)""")
+    last_id = c.fetchone()[0]
+    conn.execute("DELETE FROM sqlite_sequence WHERE name IN ('borrowed_books', 'loans')")
+    if last_id is not None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('loans', ?)", (last_id,))
+
+    conn.execute("DROP TABLE borrowed_books")
+    conn.execute("DROP TABLE loan_archive_old")
+    for statement in loan_views(returned_date=False):
+        conn.execute(statement)
+    ensure_loan_indexes(conn)
+    violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+    if violations:
+        raise sqlite3.IntegrityError(f"Foreign key violations after loan migration: {violations[:5]}")
+
+def _migrate_circulation_stats(conn):
+    # Loans returned before this have no return date and count as borrowed only
+    conn.execute("ALTER TABLE loans ADD COLUMN returned_date DATE")
+    conn.execute("ALTER TABLE loan_archive ADD COLUMN returned_date DATE")
+    # The views from migration 8 are re-created with the new column
+    conn.execute("DROP VIEW borrowed_books")
+    conn.execute("DROP VIEW loan_history")
+    for statement in loan_views():
+        conn.execute(statement)
+    ensure_circulation_stats(conn)
+
+MIGRATIONS = [
+    (1, "users, books and borrowed_books tables with seed data", _migrate_base_tables),
+    (2, "full-text search index over books", lambda conn: ensure_books_fts(conn)),
+    (3, "catalog sort and filter indexes", lambda conn: ensure_books_indexes(conn)),
+    (4, "dashboard counter tables", lambda conn: ensure_catalog_stats(conn)),
+    (5, "loan lookup indexes", lambda conn: _create_indexes(conn, 'borrowed_books', LEGACY_LOAN_INDEXES[:3])),
+    (6, "loan archive table and loan_history view",
+     lambda conn: [conn.execute(statement) for statement in LEGACY_LOAN_ARCHIVE_SCHEMA]),
+    (7, "case-insensitive prefix indexes for the book and borrower pickers",
+     lambda conn: (ensure_books_indexes(conn), _create_indexes(conn, 'borrowed_books', LEGACY_LOAN_INDEXES))),
+    (8, "patrons and loans tables with foreign keys in place of borrowed_books", _migrate_normalized_loans),
+    (9, "loan return dates and circulation rollup tables", _migrate_circulation_stats),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    # Applies pending migrations, each in its own write transaction together
+    # with its user_version bump. Returns the list of steps applied. Foreign
+    # keys are not enforced while migrating so that steps can rebuild tables.
+    applied = []
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        _apply_migrations(conn, applied)
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+    if applied:
+        invalidate_cache()
+    return applied
+
+def _apply_migrations(conn, applied):
+    for number, description, step in MIGRATIONS:
+        if number <= get_schema_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if number <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append((number, description))
+
+_migrated_path = None
+_migrate_lock = threading.Lock()
+
+def init_db():
+    global _migrated_path
+    if _migrated_path == DB_PATH:
+        return
+    with _migrate_lock:
+        if _migrated_path == DB_PATH:
+            return
+        with get_connection() as conn:
+            migrate(conn)
+            # Puts back derived structures an interrupted bulk load dropped
+            ensure_loan_indexes(conn)
+            restore_books_maintenance(conn)
+        _migrated_path = DB_PATH
+
+def table_exists(conn, name):
+    c = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = ?", (name,))
+    return c.fetchone()[0] > 0
+
+def ensure_books_indexes(conn):
+    for name, columns in BOOKS_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON books {columns}")
+
+def _create_indexes(conn, table, indexes):
+    for name, columns in indexes:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {columns}")
+
+def ensure_loan_indexes(conn):
+    _create_indexes(conn, 'loans', LOAN_INDEXES)
+
+def drop_loan_indexes(conn):
+    # For bulk loads of loan history; ensure_loan_indexes() puts them back
+    for name, _ in LOAN_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+# Counter and rollup tables are backfilled whenever they or any of their
+# triggers are missing, since a missing trigger means writes went uncounted
+def ensure_catalog_stats(conn):
+    existed = all(table_exists(conn, name) for name in CATALOG_STATS_TABLES + CATALOG_STATS_TRIGGERS)
+    for statement in CATALOG_STATS_SCHEMA:
+        conn.execute(statement)
+    if not existed:
+        _rebuild_catalog_stats(conn)
+
+def ensure_circulation_stats(conn):
+    existed = all(table_exists(conn, name) for name in CIRCULATION_TABLES + CIRCULATION_TRIGGERS)
+    for statement in CIRCULATION_STATS_SCHEMA:
+        conn.execute(statement)
+    if not existed:
+        _rebuild_circulation_stats(conn)
+
+def drop_circulation_stats(conn):
+    # For bulk loads of loan history; the rollup tables stay readable and
+    # ensure_circulation_stats() recounts them
+    for trigger in CIRCULATION_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+def ensure_books_fts(conn):
+    existed = table_exists(conn, 'books_fts')
+    try:
+        for statement in BOOKS_FTS_SCHEMA:
+            conn.execute(statement)
+        if not existed:
+            conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5; search_books falls back to LIKE
+        pass
+
+# Derived catalog structures (secondary indexes, FTS index, counters) can be
+# dropped for a bulk load and rebuilt from the books table afterwards. The
+# FTS table is dropped, so search falls back to LIKE until it is rebuilt.
+# Counter and rollup tables keep their last values for readers while only
+# their triggers are dropped; if a load is interrupted, the next process
+# start sees the triggers missing and recounts.
+def drop_books_maintenance(conn):
+    for trigger in ('books_fts_ai', 'books_fts_ad', 'books_fts_au') + CATALOG_STATS_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS books_fts")
+    for name, _ in BOOKS_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    # Category demand follows category changes, so it is recounted as well
+    drop_circulation_stats(conn)
+    conn.commit()
+    invalidate_cache()
+
+def restore_books_maintenance(conn):
+    # One write transaction, so writes that commit while the counters are
+    # recounted cannot be overwritten by them
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        ensure_books_indexes(conn)
+        ensure_catalog_stats(conn)
+        ensure_books_fts(conn)
+        ensure_circulation_stats(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    invalidate_cache()
+
+# Authentication functions
+def verify_login(username, password):
+    with get_connection() as conn:
+        c = conn.cursor()
+        hashed_password = hash_password(password)
+        c.execute("SELECT role, full_name FROM users WHERE username = ? AND password = ?",
+                  (username, hashed_password))
+        return c.fetchone()
+
+@cached_query
+def get_user_full_name(username):
+    with get_connection() as conn:
+        c = conn.execute("SELECT full_name FROM users WHERE username = ?", (username,))
+        row = c.fetchone()
+    return row[0] if row else None
+
+def register_user(username, password, full_name, email, role):
+    hashed_password = hash_password(password)
+
+    def op(conn):
+        conn.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                     (username, hashed_password, full_name, email, role, datetime.now().date()))
+    try:
+        run_write(op)
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+# Database functions
+@cached_query
+def get_all_books():
+    with get_connection() as conn:
+        return read_frame(conn, f"SELECT {', '.join(BOOK_COLUMNS)} FROM books", BOOK_SCHEMA)
+
+@cached_query
+def get_books_page(columns=None, after=None, page_size=PAGE_SIZE, sort_by='book_id',
+                   descending=False, category=None, available_only=False, replica=False):
+    # Returns one page of books and the cursor for the next page (None on the
+    # last page). `after` is the cursor returned by the previous call.
+    columns = list(columns or BOOK_COLUMNS)
+    for col in columns:
+        if col not in BOOK_COLUMNS:
+            raise ValueError(f"Unknown book column: {col}")
+    if sort_by not in BOOK_SORT_FIELDS.values():
+        raise ValueError(f"Unknown sort field: {sort_by}")
+
+    where, params = [], []
+    if category:
+        where.append("category = ?")
+        params.append(category)
+    if available_only:
+        where.append("available > 0")
+
+    op = '<' if descending else '>'
+    direction = 'DESC' if descending else 'ASC'
+    if sort_by in ('book_id', 'rowid'):
+        if after is not None:
+            where.append(f"{sort_by} {op} ?")
+            params.append(after[0])
+        order_by = f"{sort_by} {direction}"
+    else:
+        if after is not None:
+            where.append(f"({sort_by}, book_id) {op} (?, ?)")
+            params.extend(after)
+        order_by = f"{sort_by} {direction}, book_id {direction}"
+
+    sql = f"SELECT {sort_by} AS _sort_key, book_id AS _cursor_id, {', '.join(columns)} FROM books"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order_by} LIMIT ?"
+    params.append(page_size + 1)
+
+    with get_read_connection(replica) as conn:
+        df = read_frame(conn, sql, BOOK_SCHEMA, params)
+
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        # numpy scalars cannot be bound as SQLite parameters
+        next_cursor = tuple(v.item() if hasattr(v, 'item') else v
+                            for v in df[['_sort_key', '_cursor_id']].iloc[-1])
+    return df.drop(columns=['_sort_key', '_cursor_id']), next_cursor
+
+@cached_query
+def get_book(book_id):
+    # One book as a dict, or None if it does not exist
+    with get_connection() as conn:
+        c = conn.execute(f"SELECT {', '.join(BOOK_COLUMNS)} FROM books WHERE book_id = ?", (book_id,))
+        row = c.fetchone()
+    return dict(zip(BOOK_COLUMNS, row)) if row else None
+
+@cached_query
+def get_book_categories(replica=False):
+    with get_read_connection(replica) as conn:
+        c = conn.execute("SELECT category FROM category_stats WHERE titles > 0 ORDER BY category")
+        return [row[0] for row in c.fetchall()]
+
+@cached_query
+def get_borrowed_books():
+    with get_connection() as conn:
+        return read_frame(conn, loan_select(), LOAN_SCHEMA)
+
+# Loan queries
+# Dates are stored as ISO 'YYYY-MM-DD' text, so comparisons happen in SQL and
+# the (status, due_date) index serves both open-loan and overdue lookups,
+# joining to books and patrons by primary key for the titles and names.
+@cached_query
+def get_open_loans():
+    with get_connection() as conn:
+        return read_frame(conn, f"{loan_select()} WHERE l.status = 'Borrowed' ORDER BY l.due_date", LOAN_SCHEMA)
+
+def get_overdue_loans(today=None):
+    # Resolve the date before the cache lookup so results roll over at midnight
+    return _get_overdue_loans((today or datetime.now().date()).isoformat())
+
+@cached_query
+def _get_overdue_loans(today):
+    with get_connection() as conn:
+        return read_frame(conn, f"{loan_select()} WHERE l.status = 'Borrowed' AND l.due_date < ? ORDER BY l.due_date",
+                          LOAN_SCHEMA, (today,))
+
+@cached_query
+def get_loans_by_borrower(borrower_id, open_only=True, include_archive=False):
+    # Open loans are never archived, so only full-history reads look there
+    sql = f"{loan_select()} WHERE p.borrower_id = ?"
+    params = [borrower_id]
+    if open_only:
+        sql += " AND l.status = 'Borrowed'"
+    elif include_archive:
+        sql += f" UNION ALL {loan_select('loan_archive')} WHERE p.borrower_id = ?"
+        params.append(borrower_id)
+    with get_connection() as conn:
+        return read_frame(conn, sql + " ORDER BY borrow_date, id", LOAN_SCHEMA, params)
+
+def add_book(book_id, title, author, isbn, category, quantity, available, status):
+    def op(conn):
+        conn.execute(f"INSERT INTO books ({', '.join(BOOK_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (book_id, title, author, isbn, category, quantity, available, status))
+    try:
+        run_write(op)
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def update_book_availability(book_id, available, status):
+    def op(conn):
+        conn.execute("UPDATE books SET available = ?, status = ? WHERE book_id = ?",
+                     (available, status, book_id))
+    run_write(op)
+
+def _upsert_patron(conn, borrower_id, borrower_name):
+    # Keeps the name from the latest loan, like the desk forms always did
+    conn.execute("""INSERT INTO patrons (borrower_id, name, username)
+                    VALUES (?, ?, (SELECT username FROM users WHERE username = ?))
+                    ON CONFLICT (borrower_id) DO UPDATE SET name = excluded.name
+                    WHERE name != excluded.name""", (borrower_id, borrower_name, borrower_id))
+
+def add_borrowed_book(book_id, title, borrower_name, borrower_id, borrow_date, due_date, status):
+    # `title` is kept for callers; the loan shows the book's current title
+    def op(conn):
+        _upsert_patron(conn, borrower_id, borrower_name)
+        c = conn.execute("""INSERT INTO loans (book_id, patron_id, borrow_date, due_date, status)
+                            SELECT b.id, p.id, ?, ?, ? FROM books b, patrons p
+                            WHERE b.book_id = ? AND p.borrower_id = ?""",
+                         (borrow_date, due_date, status, book_id, borrower_id))
+        if c.rowcount == 0:
+            raise CirculationError(f"Book {book_id} does not exist.")
+    run_write(op)
+
+def update_borrowed_book_status(book_id, borrower_id, status):
+    def op(conn):
+        conn.execute("""UPDATE loans SET status = ?, returned_date = CASE WHEN ? = 'Returned' THEN date('now', 'localtime') END
+                        WHERE book_id = (SELECT id FROM books WHERE book_id = ?)
+                          AND patron_id = (SELECT id FROM patrons WHERE borrower_id = ?)
+                          AND status = 'Borrowed'""", (status, status, book_id, borrower_id))
+    run_write(op)
+
+# Search functions
+def has_fts(conn):
+    c = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'books_fts'")
+    return c.fetchone()[0] > 0
+
+def build_fts_query(query, columns):
+    # Every word becomes a quoted prefix term so user input can never be
+    # parsed as FTS5 syntax; all words must match somewhere in `columns`
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    return '{%s} : (%s)' % (' '.join(columns), ' '.join('"%s"*' % t for t in terms))
+
+@cached_query
+def search_books(query, field='All Fields', limit=SEARCH_LIMIT, replica=True):
+    columns = SEARCH_FIELDS[field]
+    selected = ', '.join('b.' + col for col in BOOK_COLUMNS)
+    with get_read_connection(replica) as conn:
+        if has_fts(conn):
+            fts_query = build_fts_query(query, columns)
+            if fts_query is None:
+                return read_frame(conn, f"SELECT {', '.join(BOOK_COLUMNS)} FROM books LIMIT 0", BOOK_SCHEMA)
+            # bm25 weights follow the FTS column order: book_id, title, author, category
+            return read_frame(
+                conn,
+                f"""SELECT {selected} FROM books_fts
+                   JOIN books b ON b.id = books_fts.rowid
+                   WHERE books_fts MATCH ?
+                   ORDER BY bm25(books_fts, 10.0, 5.0, 3.0, 1.0)
+                   LIMIT ?""",
+                BOOK_SCHEMA, (fts_query, limit))
+        where = ' OR '.join(f"{col} LIKE ?" for col in columns)
+        return read_frame(conn, f"SELECT {selected} FROM books b WHERE {where} LIMIT ?", BOOK_SCHEMA,
+                          [f"%{query}%"] * len(columns) + [limit])
+
+# Typeahead lookups
+# Top matches for the search-as-you-type pickers. LIKE 'prefix%' against a
+# NOCASE index is answered as an index range scan and stops at `limit`, so
+# the cost depends on the number of matches shown, not on the table size.
+TYPEAHEAD_LIMIT = 20
+PICKER_COLUMNS = ['book_id', 'title', 'author', 'isbn', 'available']
+
+def like_prefix(text):
+    return re.sub(r'([\\%_])', r'\\\1', text) + '%'
+
+@cached_query
+def find_books(prefix, limit=TYPEAHEAD_LIMIT, available_only=False):
+    # Book ID and ISBN prefix matches first, then title word prefixes
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    columns = ', '.join('b.' + col for col in PICKER_COLUMNS)
+    available = " AND b.available > 0" if available_only else ""
+    pattern = like_prefix(prefix)
+    queries = [
+        (f"SELECT {columns} FROM books b WHERE b.book_id LIKE ? ESCAPE '\\'{available} "
+         f"ORDER BY b.book_id COLLATE NOCASE LIMIT ?", (pattern, limit)),
+        (f"SELECT {columns} FROM books b WHERE b.isbn LIKE ? ESCAPE '\\'{available} "
+         f"ORDER BY b.isbn COLLATE NOCASE LIMIT ?", (pattern, limit)),
+    ]
+    matches = {}
+    with get_connection() as conn:
+        fts_query = build_fts_query(prefix, ['title']) if has_fts(conn) else None
+        if fts_query:
+            # Unranked, so the FTS cursor stops after `limit` matches
+            queries.append((f"SELECT {columns} FROM books_fts JOIN books b ON b.id = books_fts.rowid "
+                            f"WHERE books_fts MATCH ?{available} LIMIT ?", (fts_query, limit)))
+        else:
+            queries.append((f"SELECT {columns} FROM books b WHERE b.title LIKE ? ESCAPE '\\'{available} LIMIT ?",
+                            (pattern, limit)))
+        for sql, params in queries:
+            for row in conn.execute(sql, params):
+                matches.setdefault(row[0], dict(zip(PICKER_COLUMNS, row)))
+                if len(matches) >= limit:
+                    return list(matches.values())
+    return list(matches.values())
+
+@cached_query
+def find_open_borrowers(prefix, limit=TYPEAHEAD_LIMIT):
+    # Borrower IDs with at least one open loan
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    with get_connection() as conn:
+        c = conn.execute("""SELECT p.borrower_id FROM patrons p
+                            WHERE p.borrower_id LIKE ? ESCAPE '\\'
+                              AND EXISTS (SELECT 1 FROM loans l WHERE l.patron_id = p.id AND l.status = 'Borrowed')
+                            ORDER BY p.borrower_id COLLATE NOCASE LIMIT ?""", (like_prefix(prefix), limit))
+        return [row[0] for row in c.fetchall()]
+
+# Dashboard counters
+@cached_query
+def get_catalog_stats():
+    with get_connection() as conn:
+        c = conn.execute("SELECT total_titles, total_copies, available_copies FROM catalog_stats WHERE id = 1")
+        row = c.fetchone() or (0, 0, 0)
+    return {'total_titles': row[0], 'total_copies': row[1], 'available_copies': row[2]}
+
+@cached_query
+def get_category_counts():
+    with get_connection() as conn:
+        return read_frame(
+            conn, "SELECT category, titles, copies, available FROM category_stats WHERE titles > 0 ORDER BY titles DESC",
+            CATEGORY_COUNTS_SCHEMA)
+
+def compute_catalog_stats(conn):
+    # Recomputes the counters from the books table (full scan)
+    c = conn.execute("SELECT COUNT(*), IFNULL(SUM(quantity), 0), IFNULL(SUM(available), 0) FROM books")
+    totals = c.fetchone()
+    c = conn.execute("""SELECT category, COUNT(*), IFNULL(SUM(quantity), 0), IFNULL(SUM(available), 0)
+                        FROM books WHERE category IS NOT NULL GROUP BY category""")
+    return totals, {row[0]: row[1:] for row in c.fetchall()}
+
+def _rebuild_catalog_stats(conn):
+    # Rewrites the counters inside the caller's transaction
+    totals, categories = compute_catalog_stats(conn)
+    conn.execute("INSERT OR REPLACE INTO catalog_stats (id, total_titles, total_copies, available_copies) VALUES (1, ?, ?, ?)",
+                 totals)
+    conn.execute("DELETE FROM category_stats")
+    conn.executemany("INSERT INTO category_stats (category, titles, copies, available) VALUES (?, ?, ?, ?)",
+                     [(category,) + counts for category, counts in categories.items()])
+
+def rebuild_catalog_stats():
+    # Runs as a write op, so the recount and the rewrite share one write
+    # transaction and no borrow or return can commit in between
+    run_write(_rebuild_catalog_stats)
+
+def verify_catalog_stats():
+    # Returns a list of human-readable differences between the maintained
+    # counters and a fresh recount; an empty list means no drift
+    with get_connection() as conn:
+        conn.execute("BEGIN")
+        totals, categories = compute_catalog_stats(conn)
+        c = conn.execute("SELECT total_titles, total_copies, available_copies FROM catalog_stats WHERE id = 1")
+        stored_totals = c.fetchone() or (0, 0, 0)
+        c = conn.execute("SELECT category, titles, copies, available FROM category_stats WHERE titles != 0 OR copies != 0 OR available != 0")
+        stored_categories = {row[0]: row[1:] for row in c.fetchall()}
+        conn.rollback()
+
+    drift = []
+    for name, stored, actual in zip(['total_titles', 'total_copies', 'available_copies'], stored_totals, totals):
+        if stored != actual:
+            drift.append(f"{name}: stored {stored}, actual {actual}")
+    for category in sorted(set(stored_categories) | set(categories)):
+        stored = stored_categories.get(category, (0, 0, 0))
+        actual = categories.get(category, (0, 0, 0))
+        if tuple(stored) != tuple(actual):
+            drift.append(f"category {category!r}: stored {tuple(stored)}, actual {tuple(actual)}")
+    return drift
+
+# Circulation analytics
+# Dashboard charts over the rollup tables; none of these read loans
+def get_daily_circulation(days=CIRCULATION_DAYS, today=None):
+    # Resolve the date before the cache lookup so the window rolls over at midnight
+    since = (today or datetime.now().date()) - timedelta(days=days - 1)
+    return _get_daily_circulation(since.isoformat())
+
+@cached_query
+def _get_daily_circulation(since):
+    with get_connection() as conn:
+        return read_frame(conn, "SELECT day, borrowed, returned FROM circulation_daily WHERE day >= ? ORDER BY day",
+                          CIRCULATION_SCHEMA, (since,))
+
+@cached_query
+def get_monthly_circulation(months=CIRCULATION_MONTHS):
+    # Loans and returns per month, and the share of returns that came back late
+    with get_connection() as conn:
+        return read_frame(
+            conn,
+            """SELECT * FROM (
+                   SELECT substr(day, 1, 7) AS month, SUM(borrowed) AS borrowed, SUM(returned) AS returned,
+                          SUM(returned_late) AS returned_late,
+                          1.0 * SUM(returned_late) / NULLIF(SUM(returned), 0) AS late_rate
+                   FROM circulation_daily GROUP BY month ORDER BY month DESC LIMIT ?)
+               ORDER BY month""",
+            CIRCULATION_SCHEMA, (months,))
+
+@cached_query
+def get_most_borrowed(limit=MOST_BORROWED_LIMIT):
+    with get_connection() as conn:
+        return read_frame(
+            conn,
+            """SELECT b.book_id, b.title, b.author, c.loans FROM book_circulation c
+               JOIN books b ON b.id = c.book_id
+               ORDER BY c.loans DESC LIMIT ?""",
+            CIRCULATION_SCHEMA, (limit,))
+
+@cached_query
+def get_category_demand():
+    with get_connection() as conn:
+        return read_frame(conn, "SELECT category, loans FROM category_circulation WHERE loans > 0 ORDER BY loans DESC",
+                          CIRCULATION_SCHEMA)
+
+def compute_circulation_stats(conn):
+    # Recomputes the rollups from loans and loan_archive (full scan)
+    c = conn.execute(f"""SELECT day, SUM(borrowed), SUM(returned), SUM(returned_late) FROM (
+                             SELECT borrow_date AS day, 1 AS borrowed, 0 AS returned, 0 AS returned_late
+                             FROM ({CIRCULATION_HISTORY}) WHERE borrow_date IS NOT NULL
+                             UNION ALL
+                             SELECT returned_date, 0, 1, IFNULL(returned_date > due_date, 0)
+                             FROM ({CIRCULATION_HISTORY}) WHERE returned_date IS NOT NULL)
+                         GROUP BY day""")
+    daily = {row[0]: row[1:] for row in c.fetchall()}
+    c = conn.execute(f"SELECT book_id, COUNT(*) FROM ({CIRCULATION_HISTORY}) GROUP BY book_id")
+    books = dict(c.fetchall())
+    c = conn.execute(f"""SELECT b.category, COUNT(*) FROM ({CIRCULATION_HISTORY}) h
+                         JOIN books b ON b.id = h.book_id
+                         WHERE b.category IS NOT NULL GROUP BY b.category""")
+    categories = dict(c.fetchall())
+    return daily, books, categories
+
+def _rebuild_circulation_stats(conn):
+    # Rewrites the rollups inside the caller's transaction
+    daily, books, categories = compute_circulation_stats(conn)
+    for table in CIRCULATION_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    conn.executemany("INSERT INTO circulation_daily (day, borrowed, returned, returned_late) VALUES (?, ?, ?, ?)",
+                     [(day,) + counts for day, counts in daily.items()])
+    conn.executemany("INSERT INTO book_circulation (book_id, loans) VALUES (?, ?)", books.items())
+    conn.executemany("INSERT INTO category_circulation (category, loans) VALUES (?, ?)", categories.items())
+
+def rebuild_circulation_stats():
+    # A write op like rebuild_catalog_stats(): borrows and returns wait for
+    # the recount instead of being overwritten by it
+    run_write(_rebuild_circulation_stats)
+
+def verify_circulation_stats():
+    # Like verify_catalog_stats(), for the circulation rollups
+    with get_connection() as conn:
+        conn.execute("BEGIN")
+        daily, books, categories = compute_circulation_stats(conn)
+        c = conn.execute("SELECT day, borrowed, returned, returned_late FROM circulation_daily")
+        stored_daily = {row[0]: row[1:] for row in c.fetchall() if any(row[1:])}
+        stored_books = dict(conn.execute("SELECT book_id, loans FROM book_circulation WHERE loans != 0").fetchall())
+        stored_categories = dict(conn.execute("SELECT category, loans FROM category_circulation WHERE loans != 0").fetchall())
+        conn.rollback()
+
+    drift = []
+    for day in sorted(set(stored_daily) | set(daily)):
+        stored, actual = tuple(stored_daily.get(day, (0, 0, 0))), tuple(daily.get(day, (0, 0, 0)))
+        if stored != actual:
+            drift.append(f"day {day}: stored (borrowed, returned, late) {stored}, actual {actual}")
+    changed_books = [book for book in set(stored_books) | set(books) if stored_books.get(book, 0) != books.get(book, 0)]
+    if changed_books:
+        drift.append(f"loan counts differ for {len(changed_books)} book(s)")
+    for category in sorted(set(stored_categories) | set(categories)):
+        stored, actual = stored_categories.get(category, 0), categories.get(category, 0)
+        if stored != actual:
+            drift.append(f"category {category!r}: stored {stored} loans, actual {actual}")
+    return drift
+
+# Circulation
+# Each borrow or return is one group-commit op: the availability change is a
+# conditional UPDATE evaluated inside SQLite's write transaction, so concurrent
+# desks can never oversell a copy, and the loan row is written in the same
+# savepoint, so a failed borrow or return leaves nothing behind.
+class CirculationError(Exception):
+    pass
+
+def _begin_immediate(conn):
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError as e:
+        raise CirculationError("The library database is busy, please try again.") from e
+
+def borrow_book(book_id, borrower_name, borrower_id, borrow_date, due_date):
+    def op(conn):
+        c = conn.execute("""UPDATE books
+                            SET available = available - 1,
+                                status = CASE WHEN available - 1 > 0 THEN 'Available' ELSE 'Out of Stock' END
+                            WHERE book_id = ? AND available > 0""", (book_id,))
+        if c.rowcount == 0:
+            c = conn.execute("SELECT 1 FROM books WHERE book_id = ?", (book_id,))
+            if c.fetchone() is None:
+                raise CirculationError(f"Book {book_id} does not exist.")
+            raise CirculationError(f"No copies of {book_id} are currently available.")
+        _upsert_patron(conn, borrower_id, borrower_name)
+        conn.execute("""INSERT INTO loans (book_id, patron_id, borrow_date, due_date, status)
+                        SELECT b.id, p.id, ?, ?, 'Borrowed' FROM books b, patrons p
+                        WHERE b.book_id = ? AND p.borrower_id = ?""",
+                     (borrow_date, due_date, book_id, borrower_id))
+    run_write(op)
+
+def return_book(book_id, borrower_id, returned_date=None):
+    returned_date = returned_date or datetime.now().date()
+
+    def op(conn):
+        # Close the oldest open loan for this borrower and book
+        c = conn.execute("""UPDATE loans SET status = 'Returned', returned_date = ?
+                            WHERE id = (SELECT l.id FROM loans l
+                                        JOIN books b ON b.id = l.book_id
+                                        JOIN patrons p ON p.id = l.patron_id
+                                        WHERE b.book_id = ? AND p.borrower_id = ? AND l.status = 'Borrowed'
+                                        ORDER BY l.borrow_date, l.id LIMIT 1)""",
+                         (returned_date, book_id, borrower_id))
+        if c.rowcount == 0:
+            raise CirculationError(f"{borrower_id} has no open loan for {book_id}; it may already have been returned.")
+        # Capped at quantity, so a return can never report more copies on the
+        # shelf than the library owns
+        conn.execute("""UPDATE books
+                        SET available = MIN(available + 1, quantity),
+                            status = CASE WHEN MIN(available + 1, quantity) > 0 THEN 'Available' ELSE 'Out of Stock' END
+                        WHERE book_id = ?""", (book_id,))
+    run_write(op)
+
+# Loan archival
+def archive_loans(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, today=None, progress=None):
+    # Moves loans returned more than `older_than_days` ago into
+    # loan_archive, one short write transaction per batch so the app and
+    # the API keep borrowing and returning while it runs. Loans returned
+    # before migration 9 have no return date and are aged from their due
+    # date instead. Returns the number of loans archived; `progress(total)`
+    # is called after each batch.
+    today = today or datetime.now().date()
+    cutoff = (today - timedelta(days=older_than_days)).isoformat()
+    batch = """SELECT id FROM loans
+                 WHERE status = 'Returned' AND COALESCE(returned_date, due_date) < ?
+                 ORDER BY due_date, id LIMIT ?"""
+    total = 0
+    with get_connection() as conn:
+        while True:
+            _begin_immediate(conn)
+            try:
+                c = conn.execute(f"""INSERT INTO loan_archive ({', '.join(LOAN_KEY_COLUMNS)}, archived_date)
+                                     SELECT {', '.join(LOAN_KEY_COLUMNS)}, ? FROM loans
+                                     WHERE id IN ({batch})""", (today.isoformat(), cutoff, batch_size))
+                moved = c.rowcount
+                if moved:
+                    conn.execute(f"DELETE FROM loans WHERE id IN ({batch})", (cutoff, batch_size))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            if not moved:
+                break
+            total += moved
+            invalidate_cache()
+            if progress:
+                progress(total)
+            if moved < batch_size:
+                break
+    return total
+
+@cached_query
+def get_archive_stats():
+    with get_connection() as conn:
+        c = conn.execute("SELECT COUNT(*), MIN(borrow_date), MAX(archived_date) FROM loan_archive")
+        archived, oldest, last_run = c.fetchone()
+        c = conn.execute("SELECT COUNT(*) FROM loans")
+        hot = c.fetchone()[0]
+    return {'hot_loans': hot, 'archived_loans': archived, 'oldest_archived': oldest, 'last_archived': last_run}
@@ -0,0 +1,125 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+# Group commit for the write helpers in database.py
+# Writes from every session are queued to a single writer thread. It takes
+# everything that queued up while the previous batch was committing, plus
+# whatever arrives within an optional extra window (up to `max_batch`
+# operations), runs them in one write transaction and commits once, so
+# concurrent desks share a commit instead of queueing on SQLite's write lock
+# one by one. Each operation runs in its own savepoint: one that raises is
+# rolled back on its own and its exception goes to that caller's future,
+# while the rest of the batch still commits.
+class GroupCommitWriter:
+    def __init__(self, connection, begin, on_commit=None, window_ms=0.0, max_batch=256):
+        self.connection = connection
+        self.begin = begin
+        self.on_commit = on_commit
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.operations = 0
+        self.failed = 0
+        self.largest_batch = 0
+
+    def submit(self, op):
+        # Queues `op(conn)` and returns a Future for its return value or
+        # exception. `op` must not commit or roll back itself.
+        future = Future()
+        self._ensure_started()
+        self._queue.put((op, future))
+        return future
+
+    def run_inline(self, op):
+        # Runs `op` in its own transaction on the calling thread
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._complete([(op, future)])
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Whatever queued up during the previous commit is taken
+                # without waiting; after that, wait out the window
+                batch.append(self._queue.get_nowait() if remaining <= 0 else self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [(op, future) for op, future in self._collect() if future.set_running_or_notify_cancel()]
+            if batch:
+                self._complete(batch)
+
+    def _complete(self, batch):
+        try:
+            outcomes = self._apply([op for op, _ in batch])
+        except BaseException as e:
+            # The transaction itself failed (busy, disk full...): nothing
+            # in the batch was committed
+            outcomes = [(False, e)] * len(batch)
+        for (_, future), (ok, value) in zip(batch, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _apply(self, ops):
+        outcomes = []
+        with self.connection() as conn:
+            self.begin(conn)
+            try:
+                for op in ops:
+                    conn.execute("SAVEPOINT group_commit_op")
+                    try:
+                        value = op(conn)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO group_commit_op")
+                        conn.execute("RELEASE group_commit_op")
+                        outcomes.append((False, e))
+                    else:
+                        conn.execute("RELEASE group_commit_op")
+                        outcomes.append((True, value))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        if self.on_commit is not None:
+            self.on_commit()
+        with self._stats_lock:
+            self.batches += 1
+            self.operations += len(ops)
+            self.failed += sum(1 for ok, _ in outcomes if not ok)
+            self.largest_batch = max(self.largest_batch, len(ops))
+        return outcomes
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'operations': self.operations,
+                'failed': self.failed,
+                'avg_batch': self.operations / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+                'queued': self._queue.qsize(),
+            }
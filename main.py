@@ -1,172 +1,41 @@
 import streamlit as st
+import os
 import pandas as pd
-import sqlite3
-import base64
-import hashlib
 from datetime import datetime, timedelta
 
+import metrics
+from assets import background_image_url
+from catalog_import import import_books, DUPLICATE_MODES
+from catalog_export import export_books, export_loans, FORMATS as EXPORT_FORMATS
+from database import (init_db, verify_login, register_user, add_book,
+                      search_books, SEARCH_FIELDS, SEARCH_LIMIT,
+                      get_books_page, get_book_categories, BOOK_SORT_FIELDS, PAGE_SIZE,
+                      get_catalog_stats, get_category_counts, verify_catalog_stats, rebuild_catalog_stats,
+                      get_daily_circulation, get_monthly_circulation, get_most_borrowed, get_category_demand,
+                      verify_circulation_stats, rebuild_circulation_stats, CIRCULATION_DAYS,
+                      borrow_book, return_book, CirculationError,
+                      get_open_loans, get_overdue_loans, get_loans_by_borrower,
+                      find_books, find_open_borrowers, TYPEAHEAD_LIMIT,
+                      archive_loans, get_archive_stats, ARCHIVE_AFTER_DAYS, get_cache_stats, get_write_stats,
+                      get_replica_stats, start_replica, REPLICA_ENABLED)
+
 # Page config
 st.set_page_config(page_title="SAD Library System", page_icon="📚", layout="wide")
 
-# Password hashing
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-# Database setup
-def init_db():
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    
-    # Create users table with roles
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (username TEXT PRIMARY KEY,
-                  password TEXT NOT NULL,
-                  full_name TEXT NOT NULL,
-                  email TEXT,
-                  role TEXT NOT NULL,
-                  created_date DATE)''')
-    
-    # Create books table
-    c.execute('''CREATE TABLE IF NOT EXISTS books
-                 (book_id TEXT PRIMARY KEY,
-                  title TEXT NOT NULL,
-                  author TEXT NOT NULL,
-                  isbn TEXT,
-                  category TEXT,
-                  quantity INTEGER,
-                  available INTEGER,
-                  status TEXT)''')
-    
-    # Create borrowed_books table
-    c.execute('''CREATE TABLE IF NOT EXISTS borrowed_books
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  book_id TEXT,
-                  title TEXT,
-                  borrower_name TEXT,
-                  borrower_id TEXT,
-                  borrow_date DATE,
-                  due_date DATE,
-                  status TEXT)''')
-    
-    # Check if default users exist
-    c.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
-    if c.fetchone()[0] == 0:
-        # Create default accounts
-        default_users = [
-            ('admin', hash_password('admin123'), 'System Administrator', 'admin@library.com', 'Administrator', datetime.now().date()),
-            ('staff', hash_password('staff123'), 'Library Staff', 'staff@library.com', 'Library Staff', datetime.now().date()),
-            ('student', hash_password('student123'), 'Student User', 'student@library.com', 'Student', datetime.now().date())
-        ]
-        c.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", default_users)
-    
-    # Check if tables are empty and add sample data
-    c.execute("SELECT COUNT(*) FROM books")
-    if c.fetchone()[0] == 0:
-        sample_books = [
-            ('B001', 'Python Programming', 'John Smith', '978-1234567890', 'Programming', 5, 5, 'Available'),
-            ('B002', 'Data Science Handbook', 'Jane Doe', '978-0987654321', 'Data Science', 3, 3, 'Available'),
-            ('B003', 'Web Development Guide', 'Mike Johnson', '978-1122334455', 'Web Development', 7, 7, 'Available')
-        ]
-        c.executemany("INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)", sample_books)
-    
-    conn.commit()
-    conn.close()
-
 # Initialize database
 init_db()
+if REPLICA_ENABLED:
+    start_replica()
 
-# Authentication functions
-def verify_login(username, password):
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    hashed_password = hash_password(password)
-    c.execute("SELECT role, full_name FROM users WHERE username = ? AND password = ?", 
-              (username, hashed_password))
-    result = c.fetchone()
-    conn.close()
-    return result
-
-def register_user(username, password, full_name, email, role):
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    try:
-        hashed_password = hash_password(password)
-        c.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
-                  (username, hashed_password, full_name, email, role, datetime.now().date()))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        conn.close()
-        return False
-
-# Database functions
-def get_all_books():
-    conn = sqlite3.connect('library.db')
-    df = pd.read_sql_query("SELECT * FROM books", conn)
-    conn.close()
-    return df
-
-def get_borrowed_books():
-    conn = sqlite3.connect('library.db')
-    df = pd.read_sql_query("SELECT * FROM borrowed_books", conn)
-    conn.close()
-    return df
-
-def add_book(book_id, title, author, isbn, category, quantity, available, status):
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    try:
-        c.execute("INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                  (book_id, title, author, isbn, category, quantity, available, status))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        conn.close()
-        return False
-
-def update_book_availability(book_id, available, status):
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("UPDATE books SET available = ?, status = ? WHERE book_id = ?",
-              (available, status, book_id))
-    conn.commit()
-    conn.close()
-
-def add_borrowed_book(book_id, title, borrower_name, borrower_id, borrow_date, due_date, status):
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO borrowed_books (book_id, title, borrower_name, borrower_id, borrow_date, due_date, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
-              (book_id, title, borrower_name, borrower_id, borrow_date, due_date, status))
-    conn.commit()
-    conn.close()
-
-def update_borrowed_book_status(book_id, borrower_id, status):
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("UPDATE borrowed_books SET status = ? WHERE book_id = ? AND borrower_id = ? AND status = 'Borrowed'",
-              (status, book_id, borrower_id))
-    conn.commit()
-    conn.close()
-
-# Function to convert image to base64
-def get_base64_image(image_path):
-    try:
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode()
-    except:
-        return None
-
-# Try to load background image
-img_base64 = get_base64_image("static/LIBRARY ROOM.jpg")
+# Background image, optimized once per process and served as a static file
+background_url = background_image_url(st.get_option("server.enableStaticServing"))
 
 # Custom CSS for background
-if img_base64:
+if background_url:
     st.markdown(f"""
         <style>
         .stApp {{
-            background-image: url("data:image/jpg;base64,{img_base64}");
+            background-image: url("{background_url}");
             background-size: cover;
             background-position: center;
             background-repeat: no-repeat;
@@ -211,8 +80,83 @@ if 'role' not in st.session_state:
 if 'full_name' not in st.session_state:
     st.session_state.full_name = None
 
+# Paged book table with Previous/Next controls. The cursor stack lives in
+# session state under `key` and is reset whenever the query changes.
+def show_book_pages(key, columns=None, page_size=PAGE_SIZE, sort_by='book_id', descending=False,
+                    category=None, available_only=False, replica=False):
+    query = (tuple(columns or ()), page_size, sort_by, descending, category, available_only)
+    if st.session_state.get(f"{key}_query") != query:
+        st.session_state[f"{key}_query"] = query
+        st.session_state[f"{key}_cursors"] = [None]
+    cursors = st.session_state[f"{key}_cursors"]
+    
+    page_df, next_cursor = get_books_page(columns, cursors[-1], page_size, sort_by, descending,
+                                          category, available_only, replica)
+    st.dataframe(page_df, use_container_width=True, hide_index=True)
+    
+    col_prev, col_page, col_next = st.columns([1, 4, 1])
+    with col_prev:
+        if st.button("⬅️ Previous", key=f"{key}_prev", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Page {len(cursors)}")
+    with col_next:
+        if st.button("Next ➡️", key=f"{key}_next", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
+    return page_df
+
+# Search-as-you-type picker. st.text_input only reruns the script when the
+# user presses Enter or leaves the box, which debounces the lookup, and only
+# the top matches are sent to the browser instead of the whole collection.
+def typeahead(label, key, lookup, format_func=str, placeholder=None):
+    query = st.text_input(label, key=f"{key}_query", placeholder=placeholder).strip()
+    if not query:
+        return None
+    matches = lookup(query)
+    if not matches:
+        st.warning(f"No matches for '{query}'.")
+        return None
+    if len(matches) >= TYPEAHEAD_LIMIT:
+        st.caption(f"Showing the first {TYPEAHEAD_LIMIT} matches, type more to narrow the search.")
+    return st.selectbox("Matches", matches, format_func=format_func, key=f"{key}_choice")
+
+# Loan dates are parsed to datetimes at load time; show them as plain dates
+LOAN_COLUMN_CONFIG = {
+    'borrow_date': st.column_config.DateColumn("borrow_date", format="YYYY-MM-DD"),
+    'due_date': st.column_config.DateColumn("due_date", format="YYYY-MM-DD"),
+    'returned_date': st.column_config.DateColumn("returned_date", format="YYYY-MM-DD"),
+}
+
+# Download button for a file written by catalog_export. The path is kept in
+# session state so the button survives the rerun its own click triggers.
+EXPORT_MIME = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+def remember_export(key, path, rows):
+    previous = st.session_state.get(key)
+    if previous and previous[0] != path and os.path.exists(previous[0]):
+        os.remove(previous[0])
+    st.session_state[key] = (path, rows)
+
+def show_export_download(key, base_name):
+    export = st.session_state.get(key)
+    if not export or not os.path.exists(export[0]):
+        return
+    path, rows = export
+    fmt = os.path.splitext(path)[1].lstrip('.')
+    with open(path, 'rb') as f:
+        st.download_button(
+            label=f"📥 Download {rows:,} rows as {fmt.upper()}",
+            data=f,
+            file_name=f"{base_name}.{fmt}",
+            mime=EXPORT_MIME[fmt],
+            key=f"{key}_download"
+        )
+
 # Login/Registration Page
 if not st.session_state.logged_in:
+    metrics.begin_page("Login")
     st.title("📚 SAD Library Inventory Management System")
     
     tab1, tab2 = st.tabs(["🔐 Login", "📝 Register"])
@@ -293,13 +237,14 @@ else:
     
     # Role-based menu options
     if user_role == "Administrator":
-        menu_options = ["Dashboard", "Add Book", "Search Books", "Borrow Book", "Return Book", "Borrowed Books", "View All Books"]
+        menu_options = ["Dashboard", "Add Book", "Bulk Import", "Search Books", "Borrow Book", "Return Book", "Borrowed Books", "View All Books", "Performance"]
     elif user_role == "Library Staff":
         menu_options = ["Search Books", "Borrow Book", "Return Book", "Borrowed Books"]
     else:  # Student
         menu_options = ["Search Books", "View All Books"]
     
     menu = st.sidebar.radio("Go to", menu_options)
+    metrics.begin_page(menu)
     
     # Title
     st.title("📚 SAD Library Inventory Management System")
@@ -309,7 +254,7 @@ else:
     if menu == "Dashboard":
         st.header("📊 Dashboard")
         
-        books_df = get_all_books()
+        stats = get_catalog_stats()
         
         col1, col2, col3, col4 = st.columns(4)
         
@@ -319,10 +264,10 @@ else:
                     <h3 style='color: #f0ad4e; margin: 0;'>Total Books</h3>
                     <h1 style='color: white; margin: 10px 0;'>{}</h1>
                 </div>
-            """.format(len(books_df)), unsafe_allow_html=True)
+            """.format(stats['total_titles']), unsafe_allow_html=True)
         
         with col2:
-            total_quantity = books_df['quantity'].sum()
+            total_quantity = stats['total_copies']
             st.markdown("""
                 <div style='background: rgba(0,0,0,0.8); padding: 20px; border-radius: 10px; text-align: center;'>
                     <h3 style='color: #5bc0de; margin: 0;'>Total Copies</h3>
@@ -331,7 +276,7 @@ else:
             """.format(total_quantity), unsafe_allow_html=True)
         
         with col3:
-            available_books = books_df['available'].sum()
+            available_books = stats['available_copies']
             st.markdown("""
                 <div style='background: rgba(0,0,0,0.8); padding: 20px; border-radius: 10px; text-align: center;'>
                     <h3 style='color: #5cb85c; margin: 0;'>Available Copies</h3>
@@ -349,12 +294,62 @@ else:
             """.format(borrowed), unsafe_allow_html=True)
         
         st.subheader("📖 Recent Books")
-        st.dataframe(books_df.head(5), use_container_width=True)
+        show_book_pages("recent_books", ['book_id', 'title', 'author', 'category', 'available'],
+                        page_size=5, sort_by='rowid', descending=True)
         
         st.subheader("📂 Books by Category")
-        if not books_df.empty:
-            category_counts = books_df['category'].value_counts()
-            st.bar_chart(category_counts)
+        category_counts = get_category_counts()
+        if not category_counts.empty:
+            st.bar_chart(category_counts.set_index('category')['titles'])
+        
+        st.subheader("🔄 Circulation")
+        monthly = get_monthly_circulation()
+        if monthly.empty:
+            st.info("No loans recorded yet.")
+        else:
+            st.caption(f"Loans and returns per day, last {CIRCULATION_DAYS} days")
+            st.line_chart(get_daily_circulation().set_index('day')[['borrowed', 'returned']])
+            col1, col2 = st.columns(2)
+            with col1:
+                st.caption("Loans per month")
+                st.bar_chart(monthly.set_index('month')['borrowed'])
+            with col2:
+                st.caption("Share of returns that came back after the due date")
+                st.line_chart(monthly.set_index('month')['late_rate'])
+            col1, col2 = st.columns(2)
+            with col1:
+                st.caption("Most borrowed books")
+                st.dataframe(get_most_borrowed(), use_container_width=True, hide_index=True)
+            with col2:
+                st.caption("Loans by category")
+                st.bar_chart(get_category_demand().set_index('category')['loans'])
+        
+        with st.expander("🔧 Counter maintenance"):
+            st.caption("The counters and circulation charts above are kept up to date incrementally. "
+                       "Verify recounts the catalog and loan history to detect drift.")
+            col_verify, col_rebuild = st.columns(2)
+            with col_verify:
+                if st.button("Verify counters"):
+                    drift = verify_catalog_stats() + verify_circulation_stats()
+                    if drift:
+                        st.error("❌ Counters have drifted:\n\n" + "\n".join(f"- {line}" for line in drift))
+                    else:
+                        st.success("✅ Counters match the catalog and loan history.")
+            with col_rebuild:
+                if st.button("Rebuild counters"):
+                    rebuild_catalog_stats()
+                    rebuild_circulation_stats()
+                    st.success("✅ Counters rebuilt from the catalog and loan history.")
+                    st.rerun()
+        
+        with st.expander("⚡ Query cache"):
+            cache_stats = get_cache_stats()
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Hit rate", f"{cache_stats['hit_rate']:.0%}")
+            col2.metric("Hits / Misses", f"{cache_stats['hits']} / {cache_stats['misses']}")
+            col3.metric("Entries", cache_stats['entries'])
+            col4.metric("Memory", f"{cache_stats['bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB")
+            st.caption(f"Evictions: {cache_stats['evictions']} | Invalidations: {cache_stats['invalidations']}")
     
     # Add Book (Administrator only)
     elif menu == "Add Book":
@@ -387,27 +382,55 @@ else:
                 else:
                     st.error("❌ Please fill all required fields (*)")
     
+    # Bulk Import (Administrator only)
+    elif menu == "Bulk Import":
+        st.header("📦 Bulk Import Books")
+        st.caption("Upload a CSV or JSON Lines file with the columns book_id, title, author, isbn, category, quantity, available, status. "
+                   "Only book_id, title and author are required.")
+        
+        with st.form("bulk_import_form"):
+            upload = st.file_uploader("Catalog file", type=["csv", "jsonl", "ndjson", "json"])
+            on_duplicate = st.radio("Existing Book IDs", DUPLICATE_MODES,
+                                    format_func=lambda mode: "Skip" if mode == "skip" else "Update (upsert)")
+            defer_indexes = st.checkbox("Rebuild indexes after loading (faster for large files; search is slower and Dashboard figures are not updated until done)")
+            submit = st.form_submit_button("Import")
+            
+            if submit:
+                if upload is None:
+                    st.error("❌ Please choose a file to import!")
+                else:
+                    progress_bar = st.progress(0.0)
+                    progress_text = st.empty()
+                    
+                    def report(stats):
+                        if stats.fraction is not None:
+                            progress_bar.progress(stats.fraction)
+                        progress_text.caption(f"{stats.read:,} rows, {stats.rows_per_sec:,.0f} rows/s")
+                    
+                    try:
+                        stats = import_books(upload, on_duplicate=on_duplicate, defer_indexes=defer_indexes,
+                                             progress=report)
+                        st.success(f"✅ {stats.summary()}")
+                        if stats.errors:
+                            st.warning("⚠️ Some rows were rejected:\n\n" + "\n".join(f"- {error}" for error in stats.errors))
+                    except (ValueError, UnicodeDecodeError) as e:
+                        st.error(f"❌ Import failed: {e}")
+    
     # Search Books (All users)
     elif menu == "Search Books":
         st.header("🔍 Search Books")
         
-        books_df = get_all_books()
-        
-        search_option = st.radio("Search by:", ["Title", "Author", "Category", "Book ID"])
+        search_option = st.radio("Search by:", list(SEARCH_FIELDS))
         search_query = st.text_input(f"Enter {search_option}")
         
         if search_query:
-            if search_option == "Title":
-                results = books_df[books_df['title'].str.contains(search_query, case=False, na=False)]
-            elif search_option == "Author":
-                results = books_df[books_df['author'].str.contains(search_query, case=False, na=False)]
-            elif search_option == "Category":
-                results = books_df[books_df['category'].str.contains(search_query, case=False, na=False)]
-            else:
-                results = books_df[books_df['book_id'].str.contains(search_query, case=False, na=False)]
+            results = search_books(search_query, search_option, SEARCH_LIMIT)
             
             if not results.empty:
-                st.success(f"Found {len(results)} result(s)")
+                if len(results) >= SEARCH_LIMIT:
+                    st.success(f"Showing the top {len(results)} matches")
+                else:
+                    st.success(f"Found {len(results)} result(s)")
                 st.dataframe(results, use_container_width=True)
             else:
                 st.warning("No books found matching your search.")
@@ -420,19 +443,16 @@ else:
     elif menu == "Borrow Book":
         st.header("📤 Borrow Book")
         
-        books_df = get_all_books()
-        available_books = books_df[books_df['available'] > 0]
+        selected_book = typeahead("Find Book", "borrow_book",
+                                  lambda query: find_books(query, available_only=True),
+                                  format_func=lambda book: f"{book['book_id']} | {book['title']}",
+                                  placeholder="Book ID, ISBN or title, then press Enter")
         
-        if available_books.empty:
-            st.warning("No books available for borrowing at the moment.")
-        else:
+        if selected_book:
+            book_id = selected_book['book_id']
+            st.info(f"**Title:** {selected_book['title']}\n\n**Author:** {selected_book['author']}\n\n**Available:** {selected_book['available']}")
+            
             with st.form("borrow_form"):
-                book_id = st.selectbox("Select Book ID", available_books['book_id'].tolist())
-                
-                if book_id:
-                    selected_book = books_df[books_df['book_id'] == book_id].iloc[0]
-                    st.info(f"**Title:** {selected_book['title']}\n\n**Author:** {selected_book['author']}\n\n**Available:** {selected_book['available']}")
-                
                 borrower_name = st.text_input("Borrower Name *")
                 borrower_id = st.text_input("Borrower ID *", placeholder="e.g., STU001")
                 
@@ -443,17 +463,12 @@ else:
                 
                 if submit:
                     if borrower_name and borrower_id:
-                        # Update book availability
-                        new_available = selected_book['available'] - 1
-                        new_status = 'Out of Stock' if new_available == 0 else 'Available'
-                        update_book_availability(book_id, new_available, new_status)
-                        
-                        # Add to borrowed books
-                        add_borrowed_book(book_id, selected_book['title'], borrower_name, borrower_id, 
-                                        borrow_date, due_date, 'Borrowed')
-                        
-                        st.success(f"✅ Book borrowed successfully by {borrower_name}!")
-                        st.rerun()
+                        try:
+                            borrow_book(book_id, borrower_name, borrower_id, borrow_date, due_date)
+                            st.success(f"✅ Book borrowed successfully by {borrower_name}!")
+                            st.rerun()
+                        except CirculationError as e:
+                            st.error(f"❌ {e}")
                     else:
                         st.error("❌ Please fill all required fields!")
         
@@ -465,79 +480,195 @@ else:
     elif menu == "Return Book":
         st.header("📥 Return Book")
         
-        borrowed_df = get_borrowed_books()
-        borrowed_books = borrowed_df[borrowed_df['status'] == 'Borrowed']
+        borrower_id = typeahead("Find Borrower", "return_borrower", find_open_borrowers,
+                                placeholder="Borrower ID with books on loan, then press Enter")
         
-        if borrowed_books.empty:
-            st.warning("No books currently borrowed.")
-        else:
-            with st.form("return_form"):
-                borrower_id = st.selectbox("Select Borrower ID", borrowed_books['borrower_id'].unique().tolist())
-                
-                if borrower_id:
-                    borrower_books = borrowed_books[borrowed_books['borrower_id'] == borrower_id]
+        if borrower_id:
+            borrower_books = get_loans_by_borrower(borrower_id)
+            
+            if borrower_books.empty:
+                st.info(f"{borrower_id} has no books on loan.")
+            else:
+                with st.form("return_form"):
                     book_id = st.selectbox("Select Book to Return", borrower_books['book_id'].tolist())
                     
                     submit = st.form_submit_button("Return Book")
                     
                     if submit:
-                        books_df = get_all_books()
-                        selected_book = books_df[books_df['book_id'] == book_id].iloc[0]
-                        
-                        # Update book availability
-                        new_available = selected_book['available'] + 1
-                        update_book_availability(book_id, new_available, 'Available')
-                        
-                        # Update borrowed books status
-                        update_borrowed_book_status(book_id, borrower_id, 'Returned')
-                        
-                        st.success(f"✅ Book returned successfully!")
-                        st.rerun()
+                        try:
+                            return_book(book_id, borrower_id)
+                            st.success(f"✅ Book returned successfully!")
+                            st.rerun()
+                        except CirculationError as e:
+                            st.error(f"❌ {e}")
     
     # Borrowed Books (Administrator & Library Staff only)
     elif menu == "Borrowed Books":
         st.header("📋 Currently Borrowed Books")
         
-        borrowed_df = get_borrowed_books()
-        borrowed = borrowed_df[borrowed_df['status'] == 'Borrowed']
+        borrowed = get_open_loans()
         
         if borrowed.empty:
             st.info("No books are currently borrowed.")
         else:
-            st.dataframe(borrowed, use_container_width=True)
+            st.dataframe(borrowed, use_container_width=True, column_config=LOAN_COLUMN_CONFIG)
             
             # Check for overdue books
-            today = pd.to_datetime(datetime.now().date())
-            borrowed['due_date'] = pd.to_datetime(borrowed['due_date'])
-            overdue = borrowed[borrowed['due_date'] < today]
+            overdue = get_overdue_loans()
             
             if not overdue.empty:
                 st.warning(f"⚠️ {len(overdue)} overdue book(s)!")
-                st.dataframe(overdue, use_container_width=True)
+                st.dataframe(overdue, use_container_width=True, column_config=LOAN_COLUMN_CONFIG)
+        
+        # Export loan history (Administrator only)
+        if user_role == "Administrator":
+            with st.expander("📤 Export loan history"):
+                with st.form("loan_export_form"):
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        loan_status = st.selectbox("Status", ["All", "Borrowed", "Returned"])
+                    with col2:
+                        borrowed_range = st.date_input("Borrowed between", value=())
+                    with col3:
+                        loan_format = st.selectbox("Format", EXPORT_FORMATS, key="loan_export_format")
+                    include_archive = st.checkbox("Include archived loans")
+                    prepare = st.form_submit_button("Prepare export")
+                
+                if prepare:
+                    borrowed_from = borrowed_range[0] if len(borrowed_range) > 0 else None
+                    borrowed_to = borrowed_range[1] if len(borrowed_range) > 1 else None
+                    path, rows = export_loans(loan_format, status=None if loan_status == "All" else loan_status,
+                                              borrowed_from=borrowed_from, borrowed_to=borrowed_to,
+                                              include_archive=include_archive)
+                    remember_export("loan_export", path, rows)
+                show_export_download("loan_export", "loan_history")
+            
+            with st.expander("🗄️ Loan archive"):
+                archive_stats = get_archive_stats()
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Loans in Active Table", f"{archive_stats['hot_loans']:,}")
+                col2.metric("Archived Loans", f"{archive_stats['archived_loans']:,}")
+                col3.metric("Last Archived", archive_stats['last_archived'] or "Never")
+                st.caption("Returned loans are moved to the archive in small batches. Run `python manage.py archive-loans` "
+                           "from a scheduler to do this regularly. Loans returned before return dates were recorded "
+                           "are aged from their due date.")
+                archive_days = st.number_input("Archive loans returned more than this many days ago",
+                                               min_value=0, value=ARCHIVE_AFTER_DAYS, step=30)
+                if st.button("Archive now"):
+                    moved = archive_loans(int(archive_days))
+                    st.success(f"✅ Archived {moved:,} returned loan(s).")
     
     # View All Books (All users)
     elif menu == "View All Books":
         st.header("📚 All Books in Library")
         
-        books_df = get_all_books()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            sort_label = st.selectbox("Sort by", list(BOOK_SORT_FIELDS))
+        with col2:
+            category_filter = st.selectbox("Category", ["All"] + get_book_categories(replica=user_role == "Student"))
+        with col3:
+            page_size = st.selectbox("Rows per page", [25, 50, 100], index=0)
+        with col4:
+            descending = st.checkbox("Descending")
+            available_only = st.checkbox("Available only")
         
-        if books_df.empty:
+        page_df = show_book_pages("all_books", page_size=page_size, sort_by=BOOK_SORT_FIELDS[sort_label],
+                                  descending=descending,
+                                  category=None if category_filter == "All" else category_filter,
+                                  available_only=available_only, replica=user_role == "Student")
+        
+        if page_df.empty and category_filter == "All" and not available_only:
             st.info("No books in the library yet.")
         else:
-            st.dataframe(books_df, use_container_width=True)
-            
-            # Download as CSV (Administrator only)
+            # Export the filtered inventory (Administrator only)
             if user_role == "Administrator":
-                csv = books_df.to_csv(index=False)
-                st.download_button(
-                    label="📥 Download as CSV",
-                    data=csv,
-                    file_name="library_inventory.csv",
-                    mime="text/csv"
-                )
+                col_format, col_prepare = st.columns([1, 3])
+                with col_format:
+                    export_format = st.selectbox("Export format", EXPORT_FORMATS)
+                with col_prepare:
+                    if st.button("📄 Prepare export"):
+                        path, rows = export_books(export_format,
+                                                  category=None if category_filter == "All" else category_filter,
+                                                  available_only=available_only)
+                        remember_export("inventory_export", path, rows)
+                show_export_download("inventory_export", "library_inventory")
             else:
                 st.info("ℹ️ You can view all books and check their availability.")
     
+    # Performance (Administrator only)
+    elif menu == "Performance":
+        st.header("⏱️ Performance")
+        
+        query_events, page_events = metrics.snapshot()
+        st.caption(f"Last {len(query_events):,} queries and {len(page_events):,} page renders in this server process "
+                   f"(buffers hold {metrics.QUERY_BUFFER_SIZE:,} and {metrics.PAGE_BUFFER_SIZE:,}).")
+        top_n = st.slider("Show top", min_value=5, max_value=50, value=10)
+        
+        st.subheader("🐢 Slowest queries (by p95)")
+        query_summary = metrics.summarize(query_events, 'sql')
+        if query_summary:
+            st.dataframe(pd.DataFrame(query_summary[:top_n]), use_container_width=True, hide_index=True)
+            labels, counts = metrics.histogram(query_events)
+            st.caption("Query latency histogram")
+            st.bar_chart(pd.DataFrame({'queries': counts}, index=pd.CategoricalIndex(labels, categories=labels, ordered=True)))
+        else:
+            st.info("No queries recorded yet.")
+        
+        st.subheader("📄 Page renders")
+        page_summary = metrics.summarize(page_events, 'page')
+        if page_summary:
+            st.dataframe(pd.DataFrame(page_summary), use_container_width=True, hide_index=True)
+            labels, counts = metrics.histogram(page_events)
+            st.caption("Page render latency histogram")
+            st.bar_chart(pd.DataFrame({'renders': counts}, index=pd.CategoricalIndex(labels, categories=labels, ordered=True)))
+        else:
+            st.info("No page renders recorded yet.")
+        
+        st.subheader("🔎 Slowest individual queries")
+        slowest = sorted(query_events, key=lambda e: e['ms'], reverse=True)[:top_n]
+        if slowest:
+            st.dataframe(pd.DataFrame(slowest)[['ms', 'rows', 'page', 'sql']], use_container_width=True, hide_index=True)
+        
+        st.subheader("✍️ Group commit")
+        write_stats = get_write_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Writes", f"{write_stats['operations']:,}")
+        col2.metric("Commits", f"{write_stats['batches']:,}")
+        col3.metric("Writes per Commit", f"{write_stats['avg_batch']:.1f}")
+        col4.metric("Largest Batch", write_stats['largest_batch'])
+        st.caption(f"Failed writes: {write_stats['failed']:,} | Queued now: {write_stats['queued']}")
+        
+        st.subheader("🪞 Read replica")
+        replica_stats = get_replica_stats()
+        if replica_stats is None:
+            st.caption("Replica mode is off. Start the app with LIBRARY_REPLICA=1 to serve search and student reads from a snapshot copy.")
+        else:
+            col1, col2, col3, col4 = st.columns(4)
+            staleness = replica_stats['staleness_s']
+            col1.metric("Staleness", "n/a" if staleness is None else f"{staleness:.1f} s",
+                        help=f"Bound: {replica_stats['max_staleness_s']:g} s")
+            col2.metric("Refreshes", f"{replica_stats['refreshes']:,}")
+            col3.metric("Last Refresh", f"{replica_stats['last_refresh_ms']:.0f} ms")
+            col4.metric("Replica Reads", f"{replica_stats['reads']:,}")
+            st.caption(f"Reads sent to the primary because the copy was too stale: {replica_stats['fallbacks']:,} | "
+                       f"Copy: {replica_stats['path']}")
+            if replica_stats['last_error']:
+                st.warning(f"Last refresh failed: {replica_stats['last_error']}")
+        
+        col_save, col_clear = st.columns(2)
+        with col_save:
+            if st.button("💾 Save metrics to file"):
+                path = metrics.export()
+                st.success(f"✅ Metrics written to {path}")
+        with col_clear:
+            if st.button("🧹 Clear metrics"):
+                metrics.clear()
+                st.rerun()
+    
     # Footer
     st.sidebar.markdown("---")
     st.sidebar.info("📚 SAD Library System v4.0")
+
+# Record this run's render time on the Performance page
+metrics.end_page()
@@ -0,0 +1,134 @@
+import sys
+import argparse
+from datetime import date
+
+import database
+import catalog_import
+import catalog_export
+
+
+# Command-line maintenance tasks for the library database
+def cmd_migrate(args):
+    with database.get_connection() as conn:
+        before = database.get_schema_version(conn)
+        applied = database.migrate(conn)
+    for number, description in applied:
+        print(f"Applied migration {number}: {description}")
+    print(f"Schema version {before} -> {before if not applied else applied[-1][0]} (latest {database.SCHEMA_VERSION})")
+    return 0
+
+
+def cmd_stats(args):
+    database.init_db()
+    if args.action == 'rebuild':
+        database.rebuild_catalog_stats()
+        database.rebuild_circulation_stats()
+        print("Dashboard counters rebuilt from the books table and loan history.")
+        return 0
+    drift = database.verify_catalog_stats() + database.verify_circulation_stats()
+    if not drift:
+        print("Dashboard counters match the books table and loan history.")
+        return 0
+    print("Dashboard counters have drifted:")
+    for line in drift:
+        print(f"  - {line}")
+    return 1
+
+
+def cmd_import_books(args):
+    database.init_db()
+
+    def report(stats):
+        done = f" ({stats.fraction:.0%})" if stats.fraction is not None else ""
+        print(f"\r{stats.read:,} rows{done}, {stats.rows_per_sec:,.0f} rows/s", end='', file=sys.stderr, flush=True)
+
+    stats = catalog_import.import_books(args.file, fmt=args.format, on_duplicate=args.on_duplicate,
+                                        batch_size=args.batch_size, defer_indexes=args.defer_indexes,
+                                        progress=report)
+    print(file=sys.stderr)
+    print(stats.summary())
+    for error in stats.errors:
+        print(f"  - {error}")
+    if stats.invalid > len(stats.errors):
+        print(f"  ... and {stats.invalid - len(stats.errors)} more invalid rows")
+    return 1 if stats.invalid else 0
+
+
+def cmd_export(args):
+    database.init_db()
+    output = args.output or f"{'library_inventory' if args.table == 'books' else 'loan_history'}.{args.format}"
+    if args.table == 'books':
+        _, rows = catalog_export.export_books(args.format, output, category=args.category,
+                                              available_only=args.available_only)
+    else:
+        _, rows = catalog_export.export_loans(args.format, output, status=args.status,
+                                              borrowed_from=args.since, borrowed_to=args.until,
+                                              include_archive=args.include_archive)
+    print(f"Wrote {rows} rows to {output}")
+    return 0
+
+
+def cmd_archive_loans(args):
+    database.init_db()
+
+    def report(total):
+        print(f"\r{total:,} loans archived", end='', file=sys.stderr, flush=True)
+
+    moved = database.archive_loans(args.older_than_days, args.batch_size, progress=report)
+    if moved:
+        print(file=sys.stderr)
+    stats = database.get_archive_stats()
+    print(f"Archived {moved:,} loans returned more than {args.older_than_days} days ago "
+          f"({stats['hot_loans']:,} recent loans, {stats['archived_loans']:,} in the archive).")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SAD Library System maintenance commands")
+    parser.add_argument('--db', help="path to the SQLite database (default: library.db)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate = subparsers.add_parser('migrate', help="apply pending schema migrations")
+    migrate.set_defaults(func=cmd_migrate)
+
+    stats = subparsers.add_parser('stats', help="verify or rebuild the Dashboard counters and circulation rollups")
+    stats.add_argument('action', choices=['verify', 'rebuild'])
+    stats.set_defaults(func=cmd_stats)
+
+    import_books = subparsers.add_parser('import-books', help="bulk-load books from a CSV or JSON Lines file")
+    import_books.add_argument('file')
+    import_books.add_argument('--format', choices=['csv', 'jsonl'], help="default: from the file extension")
+    import_books.add_argument('--on-duplicate', choices=catalog_import.DUPLICATE_MODES, default='skip',
+                              help="upsert updates existing books, keeping copies on loan out of availability; "
+                                   "rows with fewer copies than are on loan are rejected")
+    import_books.add_argument('--batch-size', type=int, default=catalog_import.BATCH_SIZE)
+    import_books.add_argument('--defer-indexes', action='store_true',
+                              help="drop and rebuild indexes, search index and counters around the load")
+    import_books.set_defaults(func=cmd_import_books)
+
+    export = subparsers.add_parser('export', help="stream books or loan history to CSV or Parquet")
+    export.add_argument('table', choices=['books', 'loans'])
+    export.add_argument('--format', choices=catalog_export.FORMATS, default='csv')
+    export.add_argument('--output', help="default: library_inventory.<format> or loan_history.<format>")
+    export.add_argument('--category', help="books only")
+    export.add_argument('--available-only', action='store_true', help="books only")
+    export.add_argument('--status', choices=['Borrowed', 'Returned'], help="loans only")
+    export.add_argument('--since', type=date.fromisoformat, help="loans borrowed on or after YYYY-MM-DD")
+    export.add_argument('--until', type=date.fromisoformat, help="loans borrowed on or before YYYY-MM-DD")
+    export.add_argument('--include-archive', action='store_true', help="loans only: include archived loans")
+    export.set_defaults(func=cmd_export)
+
+    archive = subparsers.add_parser('archive-loans', help="move old returned loans into the loan archive")
+    archive.add_argument('--older-than-days', type=int, default=database.ARCHIVE_AFTER_DAYS,
+                         help=f"archive loans returned more than this many days ago (default: {database.ARCHIVE_AFTER_DAYS})")
+    archive.add_argument('--batch-size', type=int, default=database.ARCHIVE_BATCH_SIZE)
+    archive.set_defaults(func=cmd_archive_loans)
+
+    args = parser.parse_args(argv)
+    if args.db:
+        database.configure(path=args.db)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
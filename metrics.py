@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+
+# Query and page-render instrumentation
+# Every pooled SQLite connection is created with InstrumentedConnection, whose
+# cursors time each statement from execute() until its last fetch and count
+# the rows returned or changed. Page renders are timed by main.py. Both go
+# into bounded ring buffers, so memory use is fixed no matter how long the
+# process runs.
+ENABLED = os.environ.get('LIBRARY_METRICS', '1') != '0'
+QUERY_BUFFER_SIZE = int(os.environ.get('LIBRARY_METRICS_QUERIES', '5000'))
+PAGE_BUFFER_SIZE = int(os.environ.get('LIBRARY_METRICS_PAGES', '1000'))
+METRICS_DIR = os.environ.get('LIBRARY_METRICS_DIR', 'metrics')
+HISTOGRAM_BUCKETS_MS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000]
+
+_queries = deque(maxlen=QUERY_BUFFER_SIZE)
+_pages = deque(maxlen=PAGE_BUFFER_SIZE)
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def normalize_sql(sql):
+    return re.sub(r'\s+', ' ', sql).strip()[:300]
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # The event for the current statement is appended on execute and then
+    # updated in place as rows are fetched
+    _event = None
+
+    def _start(self, sql, many):
+        self._event = {
+            'ts': time.time(),
+            'sql': normalize_sql(sql),
+            'ms': 0.0,
+            'rows': 0,
+            'many': many,
+            'page': getattr(_local, 'page', None),
+        }
+        with _lock:
+            _queries.append(self._event)
+        page_stats = getattr(_local, 'page_stats', None)
+        if page_stats is not None:
+            page_stats['queries'] += 1
+
+    def _add(self, started, rows=0):
+        elapsed = (time.perf_counter() - started) * 1000
+        self._event['ms'] += elapsed
+        self._event['rows'] += rows
+        page_stats = getattr(_local, 'page_stats', None)
+        if page_stats is not None:
+            page_stats['query_ms'] += elapsed
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, False)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._add(started, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, True)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(started, max(self.rowcount, 0))
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        if self._event is not None:
+            self._add(started, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if self._event is not None:
+            self._add(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        if self._event is not None:
+            self._add(started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            if self._event is not None:
+                self._add(started)
+            raise
+        if self._event is not None:
+            self._add(started, 1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # The C implementations of the execute shortcuts bypass cursor(), so they
+    # are routed through an instrumented cursor explicitly
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+
+# Page timing
+def begin_page(name):
+    _local.page = name
+    _local.page_stats = {'queries': 0, 'query_ms': 0.0}
+    _local.page_started = time.perf_counter()
+
+def end_page():
+    name = getattr(_local, 'page', None)
+    if name is None:
+        return
+    stats = _local.page_stats
+    event = {
+        'ts': time.time(),
+        'page': name,
+        'ms': (time.perf_counter() - _local.page_started) * 1000,
+        'queries': stats['queries'],
+        'query_ms': stats['query_ms'],
+    }
+    _local.page = None
+    _local.page_stats = None
+    with _lock:
+        _pages.append(event)
+
+
+# Reporting
+def percentile(sorted_values, q):
+    # Nearest-rank percentile of an already sorted list; the benchmark runner
+    # uses it too
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values), max(1, math.ceil(q / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+def snapshot():
+    with _lock:
+        return [dict(e) for e in _queries], [dict(e) for e in _pages]
+
+def summarize(events, key):
+    # Groups events by `key` with count, total, p50/p95/p99 and max latency
+    groups = {}
+    for event in events:
+        groups.setdefault(event[key], []).append(event)
+    summary = []
+    for name, group in groups.items():
+        latencies = sorted(e['ms'] for e in group)
+        row = {
+            key: name,
+            'count': len(group),
+            'total_ms': round(sum(latencies), 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+        }
+        if 'rows' in group[0]:
+            row['avg_rows'] = round(sum(e['rows'] for e in group) / len(group), 1)
+        if 'queries' in group[0]:
+            row['avg_queries'] = round(sum(e['queries'] for e in group) / len(group), 1)
+        summary.append(row)
+    return sorted(summary, key=lambda row: row['p95_ms'], reverse=True)
+
+def histogram(events):
+    # Counts of events per latency bucket, labelled by upper bound
+    labels = [f"≤{b:g} ms" for b in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]:g} ms"]
+    counts = [0] * len(labels)
+    for event in events:
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if event['ms'] <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return labels, counts
+
+def clear():
+    with _lock:
+        _queries.clear()
+        _pages.clear()
+
+def export(path=None):
+    # Writes the buffered events as JSON Lines and returns the file path
+    if path is None:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"metrics-{datetime.now():%Y%m%d-%H%M%S}.jsonl")
+    queries, pages = snapshot()
+    with open(path, 'w', encoding='utf-8') as f:
+        for event in queries:
+            f.write(json.dumps(dict(event, type='query')) + '\n')
+        for event in pages:
+            f.write(json.dumps(dict(event, type='page')) + '\n')
+    return path
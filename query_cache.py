@@ -0,0 +1,126 @@
+import sys
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+
+# Read-through cache for the query helpers in database.py
+# Every entry is stored under the generation that was current when its query
+# started. A write (invalidate) or a change in the database's data_version
+# (a commit from any other connection or process) starts a new generation and
+# drops all entries, so a reader can never be served rows older than the last
+# commit it could have observed. Entries are evicted least-recently-used once
+# their estimated size exceeds `max_bytes`.
+class QueryCache:
+    def __init__(self, max_bytes, version_func=None):
+        self.max_bytes = max_bytes
+        self.version_func = version_func
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _clear_locked(self):
+        self._generation += 1
+        self._entries.clear()
+        self._bytes = 0
+        self.invalidations += 1
+
+    def _sync_data_version(self):
+        if self.version_func is None:
+            return
+        version = self.version_func()
+        with self._lock:
+            if version != self._data_version:
+                if self._data_version is not None:
+                    self._clear_locked()
+                self._data_version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._clear_locked()
+
+    def reset(self):
+        # Used when the cache is pointed at a different database
+        with self._lock:
+            self._clear_locked()
+            self._data_version = None
+
+    def get_or_compute(self, key, compute):
+        self._sync_data_version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        value = compute()
+        size = estimate_size(value)
+
+        with self._lock:
+            # A write that landed while the query ran makes the result stale
+            if generation == self._generation and size <= self.max_bytes:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._bytes -= old[1]
+                self._entries[key] = (value, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self._bytes -= evicted_size
+                    self.evictions += 1
+        return value
+
+    def cached(self, func):
+        # Results are shared between callers and must be treated as read-only
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, freeze(args), freeze(kwargs))
+            return self.get_or_compute(key, lambda: func(*args, **kwargs))
+        wrapper.uncached = func
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'generation': self._generation,
+            }
+
+
+def freeze(value):
+    # Turns call arguments into a hashable cache key
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(freeze(v) for v in value)
+    return value
+
+
+def estimate_size(value):
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)